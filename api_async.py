@@ -0,0 +1,516 @@
+"""
+Bản ASGI (asyncio) của api_prod.py, cho trường hợp rất nhiều kết nối chat mở
+nhưng phần lớn thời gian rảnh: mỗi request chỉ tốn một coroutine, lời gọi
+Duckling đi qua httpx.AsyncClient (pool keep-alive) thay vì một greenlet giữ
+một lời gọi requests chặn.
+
+- model.predict chạy trong ThreadPoolExecutor riêng (INFERENCE_THREADS).
+- Mỗi stage có timeout riêng: PREDICT_TIMEOUT cho phân loại (hết giờ → UNKNOWN),
+  TIME_TIMEOUT cho parse thời gian (hết giờ → {"type": "none"}).
+- /predict/batch parse thời gian của các câu đồng thời.
+- Response giống hệt api_prod.build_response_with_time.
+
+Chạy:
+    uvicorn api_async:app --port 5000 --workers 4
+    python api_async.py      # đọc PORT / WORKERS từ biến môi trường
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from attendance_store import ATTENDANCE_INTENTS, STREAM_INTENTS, AttendanceStore, attendance_reply, stream_reply
+from cache import LRUCache
+from duckling_client import AsyncDucklingClient, CircuitBreaker
+from keyword_index import KeywordIndex
+from log_utils import new_request_id, request_id_var, setup_logging, stats as logging_stats
+from model_manager import ModelManager, ModelValidationError, load_smoke_set
+from model_utils import resolve_model_path
+from nn_index import NearestNeighbourIndex, low_confidence_fallback
+from response_templates import TemplateRegistry
+from text_norm import canonical_text
+from time_utils import TZ, _next_local_midnight, normalize_duckling_times
+from relative_dates import table as relative_dates
+from vi_time_parser import has_time_hint, parse_time
+
+setup_logging()  # LOG_LEVEL, LOG_SAMPLE
+log = logging.getLogger("api_async")
+
+DUCKLING_URL = os.environ.get("DUCKLING_URL", "http://localhost:8085/parse")
+VI_LOCALE = "vi_VN"
+DUCKLING_TIMEOUT = float(os.environ.get("DUCKLING_TIMEOUT", "1.5"))
+DUCKLING_POOL_SIZE = int(os.environ.get("DUCKLING_POOL_SIZE", "50"))
+DUCKLING_MAX_CONCURRENCY = int(os.environ.get("DUCKLING_MAX_CONCURRENCY", "50"))
+DUCKLING_BREAKER_THRESHOLD = int(os.environ.get("DUCKLING_BREAKER_THRESHOLD", "5"))
+DUCKLING_BREAKER_RESET = float(os.environ.get("DUCKLING_BREAKER_RESET", "10"))
+TIME_CACHE_SIZE = int(os.environ.get("TIME_CACHE_SIZE", "10000"))
+INTENT_CACHE_SIZE = int(os.environ.get("INTENT_CACHE_SIZE", "5000"))
+KEYWORD_INDEX = os.environ.get("KEYWORD_INDEX", "1") == "1"
+KEYWORD_RULES = os.environ.get("KEYWORD_RULES", "data/keyword_rules.txt")
+NN_FALLBACK = os.environ.get("NN_FALLBACK", "1") == "1"
+NN_CONFIDENCE_THRESHOLD = float(os.environ.get("NN_CONFIDENCE_THRESHOLD", "0.5"))
+NN_K = int(os.environ.get("NN_K", "5"))
+NN_MIN_SIMILARITY = float(os.environ.get("NN_MIN_SIMILARITY", "0.8"))
+TEMPLATES_PATH = os.environ.get("TEMPLATES_PATH", "templates/responses.json")
+ATTENDANCE_DATA = os.environ.get("ATTENDANCE_DATA", "data/attendance")
+# Như api_prod.py: mã nhân viên chỉ lấy từ header của proxy đã xác thực; không đặt = bảng mẫu
+EMPLOYEE_ID_HEADER = os.environ.get("EMPLOYEE_ID_HEADER")
+STREAM_BATCH_ROWS = int(os.environ.get("STREAM_BATCH_ROWS", "100"))
+NDJSON_CONTENT_TYPE = b"application/x-ndjson"
+MAX_BATCH_TEXTS = 1000  # số câu tối đa cho /predict/batch
+MAX_BODY_BYTES = 1 << 20
+
+# Số thread chạy model.predict / tìm nn_index ngoài event loop. Binding fastText giữ GIL
+# trong lúc predict nên thêm thread không chạy song song được, chỉ thêm tranh chấp GIL
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "1"))
+# Timeout từng stage (giây)
+PREDICT_TIMEOUT = float(os.environ.get("PREDICT_TIMEOUT", "1"))
+TIME_TIMEOUT = float(os.environ.get("TIME_TIMEOUT", str(DUCKLING_TIMEOUT)))
+# wait_for ngoài chờ thêm chút so với deadline của Duckling: timeout của httpx phải nổ
+# trước để breaker đếm là lỗi, thay vì bị huỷ từ ngoài (cancel, không tính lỗi)
+TIME_TIMEOUT_MARGIN = 0.25
+TIME_PREFILTER = os.environ.get("TIME_PREFILTER", "1") == "1"
+
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "5"))
+MODEL_SMOKE_FILE = os.environ.get("MODEL_SMOKE_FILE", "data/training_data.txt")
+MODEL_SMOKE_MIN_ACCURACY = float(os.environ.get("MODEL_SMOKE_MIN_ACCURACY", "0.8"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")  # không đặt thì không có /admin/reload
+
+PORT = int(os.environ.get("PORT", "5000"))
+WORKERS = int(os.environ.get("WORKERS", "1"))
+# Kết nối keep-alive rảnh được giữ bao lâu (giây)
+KEEPALIVE_TIMEOUT = int(os.environ.get("KEEPALIVE_TIMEOUT", "75"))
+
+model_manager = ModelManager(
+    resolve_model_path(),
+    smoke_set=load_smoke_set(MODEL_SMOKE_FILE) if os.path.exists(MODEL_SMOKE_FILE) else None,
+    min_smoke_accuracy=MODEL_SMOKE_MIN_ACCURACY,
+)
+
+duckling = AsyncDucklingClient(
+    DUCKLING_URL,
+    VI_LOCALE,
+    timeout=DUCKLING_TIMEOUT,
+    pool_size=DUCKLING_POOL_SIZE,
+    max_concurrency=DUCKLING_MAX_CONCURRENCY,
+    breaker=CircuitBreaker(DUCKLING_BREAKER_THRESHOLD, DUCKLING_BREAKER_RESET),
+)
+
+time_cache = LRUCache(TIME_CACHE_SIZE)
+intent_cache = LRUCache(INTENT_CACHE_SIZE)
+_label_sets = {}  # model_version -> set label (không tiền tố __label__) của model đó
+
+
+def _model_labels(snapshot):
+    labels = _label_sets.get(snapshot.version)
+    if labels is None:
+        labels = {label.replace('__label__', '') for label in snapshot.model.get_labels()}
+        _label_sets.clear()
+        _label_sets[snapshot.version] = labels
+    return labels
+
+
+# Chỉ label model đang có; sau hot reload, label model mới không còn thì bỏ qua (_keyword_lookup)
+keyword_index = (
+    KeywordIndex.build(rules_path=KEYWORD_RULES, labels=_model_labels(model_manager.current))
+    if KEYWORD_INDEX else None
+)
+templates = TemplateRegistry.load(TEMPLATES_PATH)
+attendance = (AttendanceStore.load(ATTENDANCE_DATA)
+              if EMPLOYEE_ID_HEADER and os.path.exists(ATTENDANCE_DATA) else None)
+_inference_executor = ThreadPoolExecutor(max_workers=max(1, INFERENCE_THREADS), thread_name_prefix="inference")
+_intent_cache_version = model_manager.current.version
+
+nn_index = None
+_nn_index_requested = model_manager.current.version
+
+time_stats = {"fast_path": 0, "duckling_path": 0, "skipped": 0}
+stage_stats = {"predict_timeouts": 0, "time_timeouts": 0}
+
+
+# ---------------------------------------------------------------- time
+
+async def resolve_time(text: str):
+    """Như api_prod.resolve_time, nhưng gọi Duckling bất đồng bộ và giới hạn bởi TIME_TIMEOUT."""
+    now = datetime.now(TZ)
+    fast = parse_time(text, now=now)
+    if fast is not None:
+        time_stats["fast_path"] += 1
+        return fast
+
+    time_stats["duckling_path"] += 1
+    key = (canonical_text(text), now.date().isoformat())
+    cached = time_cache.get(key)
+    if cached is not None:
+        return cached
+
+    deadline = time.monotonic() + TIME_TIMEOUT
+    try:
+        duck_resp = await asyncio.wait_for(
+            duckling.parse(text, ref_time=now, deadline=deadline, default=None),
+            TIME_TIMEOUT + TIME_TIMEOUT_MARGIN,
+        )
+    except asyncio.TimeoutError:
+        stage_stats["time_timeouts"] += 1
+        duck_resp = None
+    if duck_resp is None:
+        return {"type": "none"}
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("duckling.response", extra={"fields": {"text": text, "response": duck_resp}})
+    time_info = normalize_duckling_times(duck_resp)
+    if time_info.get("grain") not in ("hour", "minute", "second"):
+        time_cache.set(key, time_info, expires_at=_next_local_midnight(now).timestamp())
+    return time_info
+
+
+# ---------------------------------------------------------------- intent
+
+def _sync_intent_cache():
+    global _intent_cache_version
+    version = model_manager.current.version
+    if _intent_cache_version != version:
+        intent_cache.clear()
+        _intent_cache_version = version
+
+
+def _model_predict(snapshot, texts, k=1):
+    """Chạy trong _inference_executor: 1 lần model.predict cho cả danh sách câu."""
+    lines = [t.replace('\n', ' ').replace('\r', ' ') for t in texts]
+    labels, probs = snapshot.model.predict(lines, k=k)
+    results = []
+    for lbls, ps in zip(labels, probs):
+        if not lbls:
+            results.append(("UNKNOWN", 0.0, snapshot.version))
+            continue
+        results.append((lbls[0].replace('__label__', ''), float(ps[0]), snapshot.version))
+    return results
+
+
+def _keyword_lookup(key):
+    """(intent, 1.0, model_version) nếu keyword_index biết câu này, không thì None"""
+    if keyword_index is None:
+        return None
+    label = keyword_index.lookup(key)
+    snapshot = model_manager.current
+    if label is None or label not in _model_labels(snapshot):
+        return None
+    return label, 1.0, snapshot.version
+
+
+async def predict_many(texts, k=1):
+    """[(intent, confidence, model_version)] theo thứ tự texts, qua keyword_index và intent_cache."""
+    keys = [canonical_text(t) for t in texts]
+    _sync_intent_cache()
+    results = {}
+    misses = []
+    for key in keys:
+        if key in results:
+            continue
+        known = _keyword_lookup(key)
+        if known is not None:
+            results[key] = known
+            continue
+        cached = intent_cache.get(key)
+        results[key] = cached
+        if cached is None:
+            misses.append(key)
+
+    if misses:
+        snapshot = model_manager.current
+        loop = asyncio.get_running_loop()
+        try:
+            predicted = await asyncio.wait_for(
+                loop.run_in_executor(_inference_executor, _model_predict, snapshot, misses, k),
+                PREDICT_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            stage_stats["predict_timeouts"] += 1
+            predicted = [("UNKNOWN", 0.0, snapshot.version)] * len(misses)
+        except Exception as e:
+            predicted = [("UNKNOWN", 0.0, snapshot.version)] * len(misses)
+        for key, result in zip(misses, predicted):
+            results[key] = result
+            if result[0] != "UNKNOWN" and result[2] == _intent_cache_version:
+                intent_cache.set(key, result)
+    return [results[key] for key in keys]
+
+
+def _load_nn_index(snapshot):
+    global nn_index
+    try:
+        nn_index = NearestNeighbourIndex.load_or_build(snapshot.model, snapshot.path, snapshot.version)
+    except Exception as e:
+        log.error("nn_index.load_failed", extra={"fields": {"version": snapshot.version, "error": str(e)}})
+
+
+if NN_FALLBACK:
+    _load_nn_index(model_manager.current)
+
+
+async def nn_fallback(texts, predictions):
+    """Như api_prod._nn_fallback; search chạy trong _inference_executor."""
+    global _nn_index_requested
+    snapshot = model_manager.current
+    index = nn_index
+    if not NN_FALLBACK or index is None or index.model_version != snapshot.version:
+        if NN_FALLBACK and _nn_index_requested != snapshot.version:
+            _nn_index_requested = snapshot.version
+            _inference_executor.submit(_load_nn_index, snapshot)
+        return [(*p, None) for p in predictions]
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _inference_executor, low_confidence_fallback, index, snapshot.model, texts, predictions,
+        NN_CONFIDENCE_THRESHOLD, NN_K, NN_MIN_SIMILARITY,
+    )
+
+
+# ---------------------------------------------------------------- response
+
+async def _time_for_intent(text, intent):
+    if "NGAY" not in intent:
+        return {"type": "none"}
+    if TIME_PREFILTER and not has_time_hint(text):
+        time_stats["skipped"] += 1
+        return templates.default_time_info(intent) or {"type": "none"}
+    return await resolve_time(text)
+
+
+async def _build_response(text, intent, confidence, model_version, extra=None, employee_id=None):
+    time_info = await _time_for_intent(text, intent)
+    summary = None
+    if employee_id and attendance is not None and intent in ATTENDANCE_INTENTS:
+        message, summary = attendance_reply(attendance, intent, str(employee_id), *templates.period(intent, time_info))
+    else:
+        message = templates.render(intent, time_info)
+    res = {
+        "intent": intent,
+        "confidence": confidence,
+        "time": time_info,
+        "message": message,
+        "model_version": model_version,
+    }
+    if summary is not None:
+        res["attendance"] = summary
+    if extra:
+        res.update(extra)
+    return res
+
+
+async def build_response_with_time(text: str, employee_id=None):
+    (intent, confidence, version, extra), = await nn_fallback([text], await predict_many([text]))
+    return await _build_response(text, intent, confidence, version, extra, employee_id)
+
+
+async def stream_response_with_time(text: str, employee_id=None):
+    """Như api_prod.stream_response_with_time: iterator các sự kiện (dict), ghi ra dạng NDJSON."""
+    (intent, confidence, version, extra), = await nn_fallback([text], await predict_many([text]))
+    if not (employee_id and attendance is not None and intent in STREAM_INTENTS):
+        return iter([await _build_response(text, intent, confidence, version, extra, employee_id)])
+    time_info = await _time_for_intent(text, intent)
+    head = {"intent": intent, "confidence": confidence, "time": time_info, "model_version": version, **(extra or {})}
+    return stream_reply(attendance, intent, str(employee_id), *templates.period(intent, time_info), head)
+
+
+async def build_responses_with_time(texts: list, employee_id=None):
+    predictions = await nn_fallback(texts, await predict_many(texts))
+    return await asyncio.gather(*(
+        _build_response(text, intent, confidence, version, extra, employee_id)
+        for text, (intent, confidence, version, extra) in zip(texts, predictions)
+    ))
+
+
+# ---------------------------------------------------------------- routes
+
+def _employee_id(headers):
+    """Mã nhân viên đã xác thực (header của proxy), None nếu tắt hoặc không có."""
+    return (headers.get(EMPLOYEE_ID_HEADER.lower()) or None) if EMPLOYEE_ID_HEADER else None
+
+
+async def predict(body, headers):
+    data = _parse_json(body)
+    if not isinstance(data, dict):
+        return 400, {"error": "Body phải là JSON object"}
+    if data.get('stream') or headers.get('accept') == NDJSON_CONTENT_TYPE.decode():
+        return 200, await stream_response_with_time(data.get('text', ''), _employee_id(headers))
+    return 200, await build_response_with_time(data.get('text', ''), _employee_id(headers))
+
+
+async def predict_batch(body, headers):
+    data = _parse_json(body)
+    texts = data.get('texts') if isinstance(data, dict) else None
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return 400, {"error": "'texts' phải là danh sách chuỗi"}
+    if len(texts) > MAX_BATCH_TEXTS:
+        return 400, {"error": f"Tối đa {MAX_BATCH_TEXTS} câu mỗi request"}
+    return 200, {"results": await build_responses_with_time(texts, _employee_id(headers))}
+
+
+async def admin_reload(body, headers):
+    """Như api_prod.admin_reload: chỉ load lại model_manager.path, lỗi chi tiết chỉ ghi log."""
+    if not hmac.compare_digest(headers.get('x-admin-token', '').encode(), ADMIN_TOKEN.encode()):
+        return 401, {"error": "unauthorized"}
+    loop = asyncio.get_running_loop()
+    try:
+        version = await loop.run_in_executor(None, model_manager.reload)
+    except ModelValidationError as e:
+        log.warning("admin.reload_rejected", extra={"fields": {"error": str(e)}})
+        return 409, {"error": "Model mới không đạt smoke test"}
+    except Exception as e:
+        log.error("admin.reload_failed", extra={"fields": {"error": f"{type(e).__name__}: {e}"}})
+        return 500, {"error": "Không load được model"}
+    return 200, {"model_version": version}
+
+
+async def stats(body, headers):
+    return 200, {
+        "model": model_manager.stats(),
+        "duckling": duckling.stats(),
+        "inference": dict(stage_stats, threads=INFERENCE_THREADS,
+                          predict_timeout=PREDICT_TIMEOUT, time_timeout=TIME_TIMEOUT),
+        "keyword_index": keyword_index.stats() if keyword_index is not None else None,
+        "nn_index": nn_index.stats() if nn_index is not None else None,
+        "attendance": attendance.stats() if attendance is not None else None,
+        "intent_cache": intent_cache.stats(),
+        "time_cache": time_cache.stats(),
+        "time_parse": time_stats,
+        "relative_dates": relative_dates.stats(),
+        "logging": logging_stats(),
+    }
+
+
+ROUTES = {
+    ('POST', '/predict'): predict,
+    ('POST', '/predict/batch'): predict_batch,
+    ('GET', '/stats'): stats,
+}
+if ADMIN_TOKEN:
+    ROUTES[('POST', '/admin/reload')] = admin_reload
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET,POST,PUT,DELETE,OPTIONS"),
+    (b"access-control-allow-headers", b"Content-Type,Authorization"),
+]
+
+
+def _parse_json(body):
+    try:
+        return json.loads(body or b'{}')
+    except ValueError:
+        return None
+
+
+def _dumps(payload):
+    # Cùng định dạng với flask.jsonify: key sắp xếp, escape non-ASCII, không khoảng trắng
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode() + b"\n"
+
+
+async def _send(send, status, body=b"", content_type=b"application/json"):
+    headers = [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]
+    request_id = request_id_var.get()
+    if request_id:
+        headers.append((b"x-request-id", request_id.encode('latin-1')))
+    await send({"type": "http.response.start", "status": status, "headers": headers + CORS_HEADERS})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _ndjson(event) -> bytes:
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+async def _send_stream(send, status, events):
+    """Chunked (không content-length): dòng đầu gửi ngay, sau đó STREAM_BATCH_ROWS dòng mỗi lần."""
+    headers = [(b"content-type", NDJSON_CONTENT_TYPE)]
+    request_id = request_id_var.get()
+    if request_id:
+        headers.append((b"x-request-id", request_id.encode('latin-1')))
+    await send({"type": "http.response.start", "status": status, "headers": headers + CORS_HEADERS})
+    batch = []
+    for i, event in enumerate(events):
+        batch.append(_ndjson(event))
+        if i == 0 or len(batch) >= STREAM_BATCH_ROWS:
+            await send({"type": "http.response.body", "body": b"".join(batch), "more_body": True})
+            batch = []
+    await send({"type": "http.response.body", "body": b"".join(batch)})
+
+
+async def _read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise ValueError("body too large")
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await duckling.start()
+            relative_dates.start_refresher()
+            if MODEL_WATCH_INTERVAL > 0:
+                model_manager.watch(MODEL_WATCH_INTERVAL)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await duckling.aclose()
+            _inference_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get("headers", [])}
+    # Mỗi request là một task riêng nên giá trị này chỉ thuộc request hiện tại
+    request_id_var.set(headers.get("x-request-id") or new_request_id())
+    method = scope["method"]
+    if method == "OPTIONS":
+        await _send(send, 200, content_type=b"text/plain")
+        return
+    handler = ROUTES.get((method, scope["path"]))
+    if handler is None:
+        await _send(send, 404, _dumps({"error": "not found"}))
+        return
+
+    try:
+        body = await _read_body(receive)
+    except ValueError:
+        await _send(send, 413, _dumps({"error": "request too large"}))
+        return
+    if body is None:
+        return  # client đã ngắt kết nối
+    status, payload = await handler(body, headers)
+    if not isinstance(payload, dict):
+        await _send_stream(send, status, payload)
+        return
+    await _send(send, status, _dumps(payload))
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(
+        "api_async:app",
+        host="0.0.0.0",
+        port=PORT,
+        workers=WORKERS,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        backlog=2048,
+        lifespan="on",
+    )
@@ -1,295 +1,467 @@
-import fasttext
-import re
-import requests
-from datetime import datetime, timezone, timedelta
+from gevent import monkey
+monkey.patch_all()  # phải chạy trước mọi import dùng socket/threading
+
+import contextvars
+import hmac
+import json
+import gevent
+import logging
+import os
+import time
+from datetime import datetime
 from typing import Optional
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from attendance_store import ATTENDANCE_INTENTS, STREAM_INTENTS, AttendanceStore, attendance_reply, stream_reply
+from cache import LRUCache
+from log_utils import new_request_id, request_id_var, setup_logging, stats as logging_stats
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from duckling_client import CircuitBreaker, DucklingClient
+from keyword_index import KeywordIndex
+from model_manager import ModelManager, ModelValidationError, load_smoke_set
+from model_utils import resolve_model_path
+from nn_index import NearestNeighbourIndex, low_confidence_fallback
+from response_templates import TemplateRegistry
+from text_norm import canonical_text
+from relative_dates import table as relative_dates
+from vi_time_parser import has_time_hint, parse_time
+from time_utils import TZ, _next_local_midnight, normalize_duckling_times
+
+setup_logging()  # LOG_LEVEL, LOG_SAMPLE
+log = logging.getLogger("api_prod")
 
 app = Flask(__name__)
-# Load model
-model = fasttext.load_model('models/intent_model.bin')
-DUCKLING_URL = "http://localhost:8085/parse"
+DUCKLING_URL = os.environ.get("DUCKLING_URL", "http://localhost:8085/parse")
 VI_LOCALE = "vi_VN"
-TZ = timezone(timedelta(hours=7))  # Asia/Ho_Chi_Minh
-
-def duckling_parse_time(text: str, ref_time: Optional[datetime] = None):
+# Duckling: timeout mỗi lời gọi (giây), kích thước pool keep-alive, số lời gọi đồng thời
+DUCKLING_TIMEOUT = float(os.environ.get("DUCKLING_TIMEOUT", "1.5"))
+DUCKLING_POOL_SIZE = int(os.environ.get("DUCKLING_POOL_SIZE", "50"))
+DUCKLING_MAX_CONCURRENCY = int(os.environ.get("DUCKLING_MAX_CONCURRENCY", "50"))
+# Circuit breaker: số lỗi liên tiếp để mở, số giây trước khi thử lại
+DUCKLING_BREAKER_THRESHOLD = int(os.environ.get("DUCKLING_BREAKER_THRESHOLD", "5"))
+DUCKLING_BREAKER_RESET = float(os.environ.get("DUCKLING_BREAKER_RESET", "10"))
+# Cache kết quả Duckling đã chuẩn hoá, theo (câu, ngày); hết hạn lúc 0h giờ VN
+TIME_CACHE_SIZE = int(os.environ.get("TIME_CACHE_SIZE", "10000"))
+# Cache intent theo câu đã chuẩn hoá (chữ thường, gộp khoảng trắng, bỏ dấu câu cuối)
+INTENT_CACHE_SIZE = int(os.environ.get("INTENT_CACHE_SIZE", "5000"))
+# Trả lời ngay (không gọi model) câu trùng corpus huấn luyện / chứa cụm từ khoá trong KEYWORD_RULES
+KEYWORD_INDEX = os.environ.get("KEYWORD_INDEX", "1") == "1"
+KEYWORD_RULES = os.environ.get("KEYWORD_RULES", "data/keyword_rules.txt")
+# Câu có confidence < NN_CONFIDENCE_THRESHOLD: gợi ý câu huấn luyện gần nhất (nn_index.py),
+# đổi sang label bỏ phiếu kNN nếu câu gần nhất có cosine >= NN_MIN_SIMILARITY
+NN_FALLBACK = os.environ.get("NN_FALLBACK", "1") == "1"
+NN_CONFIDENCE_THRESHOLD = float(os.environ.get("NN_CONFIDENCE_THRESHOLD", "0.5"))
+NN_K = int(os.environ.get("NN_K", "5"))
+NN_MIN_SIMILARITY = float(os.environ.get("NN_MIN_SIMILARITY", "0.8"))
+TEMPLATES_PATH = os.environ.get("TEMPLATES_PATH", "templates/responses.json")
+# Dữ liệu chấm công thật (attendance_store.py): thư mục .npy hoặc file .csv; không có thì trả bảng mẫu
+ATTENDANCE_DATA = os.environ.get("ATTENDANCE_DATA", "data/attendance")
+# Mã nhân viên để tra dữ liệu chấm công thật: chỉ lấy từ header do proxy đã xác thực người
+# dùng đặt (VD X-Employee-Id; proxy phải ghi đè header client gửi lên), không lấy từ body.
+# Không đặt = tắt dữ liệu thật, mọi câu trả lời dùng bảng mẫu.
+EMPLOYEE_ID_HEADER = os.environ.get("EMPLOYEE_ID_HEADER")
+# /predict với "stream": true (hoặc Accept: application/x-ndjson): số dòng bảng gửi mỗi lần ghi socket
+STREAM_BATCH_ROWS = int(os.environ.get("STREAM_BATCH_ROWS", "100"))
+NDJSON_MIMETYPE = "application/x-ndjson"
+MAX_BATCH_TEXTS = 1000  # số câu tối đa cho /predict/batch
+
+
+# Speculative: câu có dấu hiệu thời gian thì parse thời gian (Duckling) song song với
+# predict; intent không cần thời gian thì bỏ kết quả
+SPECULATIVE_TIME = os.environ.get("SPECULATIVE_TIME", "0") == "1"
+# Câu không có số / từ chỉ thời gian thì không gọi Duckling, dùng default_time của intent
+TIME_PREFILTER = os.environ.get("TIME_PREFILTER", "1") == "1"
+
+# Hot reload model: chu kỳ kiểm tra file model (giây, 0 = tắt), smoke set để kiểm tra model mới
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "5"))
+MODEL_SMOKE_FILE = os.environ.get("MODEL_SMOKE_FILE", "data/training_data.txt")
+MODEL_SMOKE_MIN_ACCURACY = float(os.environ.get("MODEL_SMOKE_MIN_ACCURACY", "0.8"))
+# /admin/reload chỉ có khi đặt ADMIN_TOKEN (header X-Admin-Token); chỉ load lại file model đã cấu hình
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Server: cổng, số worker pre-fork (1 = một process như cũ), thời gian chờ request khi tắt
+PORT = int(os.environ.get("PORT", "5000"))
+WORKERS = int(os.environ.get("WORKERS", "1"))
+GRACEFUL_TIMEOUT = float(os.environ.get("GRACEFUL_TIMEOUT", "10"))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", str(PORT + 100)))  # chỉ dùng khi WORKERS > 1
+
+# Micro-batching: gom các request predict đồng thời thành 1 lần model.predict
+MICROBATCH_ENABLED = os.environ.get("MICROBATCH_ENABLED", "0") == "1"
+MICROBATCH_MAX_SIZE = int(os.environ.get("MICROBATCH_MAX_SIZE", "32"))
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get("MICROBATCH_MAX_WAIT_MS", "2"))
+MICROBATCH_MAX_QUEUE = int(os.environ.get("MICROBATCH_MAX_QUEUE", "1024"))
+
+# Load model (.bin hoặc .ftz, xem model_utils.resolve_model_path); load lại ở nền
+# trong gevent threadpool để không chặn các greenlet khác
+model_manager = ModelManager(
+    resolve_model_path(),
+    smoke_set=load_smoke_set(MODEL_SMOKE_FILE) if os.path.exists(MODEL_SMOKE_FILE) else None,
+    min_smoke_accuracy=MODEL_SMOKE_MIN_ACCURACY,
+    run_blocking=lambda fn, args=(): gevent.get_hub().threadpool.apply(fn, args),
+)
+
+duckling = DucklingClient(
+    DUCKLING_URL,
+    VI_LOCALE,
+    timeout=DUCKLING_TIMEOUT,
+    pool_size=DUCKLING_POOL_SIZE,
+    max_concurrency=DUCKLING_MAX_CONCURRENCY,
+    breaker=CircuitBreaker(DUCKLING_BREAKER_THRESHOLD, DUCKLING_BREAKER_RESET),
+)
+
+time_cache = LRUCache(TIME_CACHE_SIZE)
+_label_sets = {}  # model_version -> set label (không tiền tố __label__) của model đó
+
+
+def _model_labels(snapshot):
+    labels = _label_sets.get(snapshot.version)
+    if labels is None:
+        labels = {label.replace('__label__', '') for label in snapshot.model.get_labels()}
+        _label_sets.clear()
+        _label_sets[snapshot.version] = labels
+    return labels
+
+
+# Chỉ label model đang có; sau hot reload, label model mới không còn thì bỏ qua (_keyword_lookup)
+keyword_index = (
+    KeywordIndex.build(rules_path=KEYWORD_RULES, labels=_model_labels(model_manager.current))
+    if KEYWORD_INDEX else None
+)
+templates = TemplateRegistry.load(TEMPLATES_PATH)
+attendance = (AttendanceStore.load(ATTENDANCE_DATA)
+              if EMPLOYEE_ID_HEADER and os.path.exists(ATTENDANCE_DATA) else None)
+
+# Metrics cho /metrics (Prometheus). Mỗi process có số liệu riêng, nên với WORKERS > 1
+# các worker dùng chung cổng PORT (scrape rơi vào worker ngẫu nhiên) không có /metrics;
+# worker i phục vụ /metrics trên cổng METRICS_PORT + i, mọi series có nhãn worker="i"
+# (số thứ tự cố định, worker fork lại dùng lại số cũ). Prometheus scrape cả N cổng.
+_worker_index = None
+metrics = Registry(const_labels=(lambda: {"worker": _worker_index}) if WORKERS > 1 else None)
+STAGE_SECONDS = metrics.histogram(
+    "intent_api_stage_seconds", "Thời gian từng bước xử lý (fasttext, duckling, normalize, ...)", ("stage",))
+REQUEST_SECONDS = metrics.histogram("intent_api_request_seconds", "Thời gian xử lý request theo endpoint", ("endpoint",))
+PREDICTIONS = metrics.counter("intent_api_predictions_total", "Số câu trả lời theo intent và mức confidence",
+                              ("intent", "confidence"))
+CONFIDENCE_BUCKETS = ((0.5, "<0.5"), (0.7, "0.5-0.7"), (0.9, "0.7-0.9"), (float("inf"), ">=0.9"))
+
+def _confidence_bucket(confidence: float) -> str:
+    for bound, label in CONFIDENCE_BUCKETS:
+        if confidence < bound:
+            return label
+    return CONFIDENCE_BUCKETS[-1][1]
+
+def duckling_parse_time(text: str, ref_time: Optional[datetime] = None, deadline: Optional[float] = None, default=None):
     """
     Gọi Duckling server để parse ngày/giờ.
+    deadline: mốc time.monotonic() phải có kết quả (mặc định chỉ dùng timeout của client).
+    default: giá trị trả về khi Duckling lỗi / bị từ chối (None = list rỗng mới).
     """
     if ref_time is None:
         ref_time = datetime.now(TZ)
-    print("Duckling đang xử lí")
-    reftime_ms = int(ref_time.timestamp() * 1000)
-    # Duckling yêu cầu body x-www-form-urlencoded, không phải JSON
-    data = {
-        "locale": VI_LOCALE,
-        "text": text,
-        "dims": '["time"]',
-        "reftime": str(reftime_ms),
-    }
-    try:
-        r = requests.post(
-            DUCKLING_URL,
-            data=data,  # form-urlencoded
-            headers={"Content-Type": "application/x-www-form-urlencoded; charset=UTF-8"},
-            timeout=5
-        )
-        r.raise_for_status()
-        return r.json()
-    except Exception as e:
-        print("Duckling error:", e)
-        return []
-
-def _iso_to_dt(s: str) -> datetime:
-    # Hỗ trợ cả 'Z'
-    s = s.replace('Z', '+00:00')
-    return datetime.fromisoformat(s)
-
-def _to_iso(dt: datetime) -> str:
-    return dt.isoformat()
-
-def _add_months(dt: datetime, months: int) -> datetime:
-    y = dt.year + (dt.month - 1 + months) // 12
-    m = (dt.month - 1 + months) % 12 + 1
-    return dt.replace(year=y, month=m, day=1, hour=0, minute=0, second=0, microsecond=0)
-
-def _end_of_month(dt: datetime) -> datetime:
-    first_next = _add_months(dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 1)
-    return first_next - timedelta(seconds=1)
-
-def _expand_grain_interval(val_iso: str, grain: str, inclusive_end: bool = True, tz: timezone = TZ):
-    base = _iso_to_dt(val_iso).astimezone(tz)
-
-    if grain == "day":
-        start = base.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = start + timedelta(days=1)
-        if inclusive_end:
-            end = end - timedelta(seconds=1)
-        return _to_iso(start), _to_iso(end)
-
-    if grain == "week":
-        # Duckling thường trả đầu tuần; ta chuẩn hoá: start = ngày đó 00:00
-        start = base.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = start + timedelta(days=7)
-        if inclusive_end:
-            end = end - timedelta(seconds=1)
-        return _to_iso(start), _to_iso(end)
-
-    if grain == "month":
-        start = base.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if inclusive_end:
-            end_dt = _end_of_month(start)
-        else:
-            end_dt = _add_months(start, 1)  # exclusive
-        return _to_iso(start), _to_iso(end_dt)
-
-    if grain == "quarter":
-        # Tính quý: 1–3, 4–6, 7–9, 10–12
-        q = (base.month - 1) // 3
-        start_month = q * 3 + 1
-        start = base.replace(month=start_month, day=1, hour=0, minute=0, second=0, microsecond=0)
-        if inclusive_end:
-            end_dt = _add_months(start, 3) - timedelta(seconds=1)
-        else:
-            end_dt = _add_months(start, 3)
-        return _to_iso(start), _to_iso(end_dt)
+    log.debug("duckling.call", extra={"fields": {"text": text}})
+    return duckling.parse(text, ref_time=ref_time, deadline=deadline, default=[] if default is None else default)
 
-    if grain == "year":
-        start = base.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-        if inclusive_end:
-            end_dt = start.replace(year=start.year + 1) - timedelta(seconds=1)
-        else:
-            end_dt = start.replace(year=start.year + 1)
-        return _to_iso(start), _to_iso(end_dt)
+_DUCKLING_FAILED = object()  # default của resolve_time: phân biệt "lỗi" với "không có mốc thời gian"
 
-    # Mặc định: coi như single
-    return val_iso, val_iso
+time_stats = {"fast_path": 0, "duckling_path": 0, "skipped": 0,
+              "speculative_started": 0, "speculative_used": 0, "speculative_wasted": 0}
 
-def normalize_duckling_times(resp: list, inclusive_end: bool = True, tz: timezone = TZ):
+def resolve_time(text: str, deadline: Optional[float] = None):
     """
-    Hỗ trợ cả 2 dạng:
-    - item["values"] (list candidates)
-    - item["value"] (single object), có thể chứa 'values' bên trong.
-    """
-    if not resp:
-        return {"type": "none"}
-
-    # Ưu tiên dim='time'
-    item = next((x for x in resp if x.get("dim") == "time"), resp[0])
+    Parse thời gian trong câu về dạng của normalize_duckling_times.
 
-    # Lấy primary candidate
-    primary = None
-    top_values = item.get("values")
-    top_value = item.get("value")
-
-    if isinstance(top_values, list) and top_values:
-        primary = top_values[0]
-    elif isinstance(top_value, dict):
-        # Một số bản trả 'value' là object duy nhất; đôi khi value còn chứa 'values'
-        if isinstance(top_value.get("values"), list) and top_value["values"]:
-            primary = top_value["values"][0]
-        else:
-            primary = top_value
-
-    if not isinstance(primary, dict):
+    1. vi_time_parser: các mẫu quen thuộc, không cần gọi mạng.
+    2. duckling_parse_time + normalize_duckling_times, có cache theo câu đã chuẩn hoá
+       và ngày hiện tại (giờ VN). Kết quả theo ngày/tuần/tháng/... không đổi trong
+       ngày nên dùng lại tới 0h hôm sau; grain giờ/phút/giây thì không cache.
+    """
+    now = datetime.now(TZ)
+    with STAGE_SECONDS.time("time_fast_path"):
+        fast = parse_time(text, now=now)
+    if fast is not None:
+        time_stats["fast_path"] += 1
+        return fast
+
+    time_stats["duckling_path"] += 1
+    key = (canonical_text(text), now.date().isoformat())
+    cached = time_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with STAGE_SECONDS.time("duckling"):
+        duck_resp = duckling_parse_time(text, ref_time=now, deadline=deadline, default=_DUCKLING_FAILED)
+    if duck_resp is _DUCKLING_FAILED:
+        # Duckling lỗi: không cache để lần sau thử lại
         return {"type": "none"}
-
-    typ = primary.get("type")
-    grain = primary.get("grain")
-
-    # Interval (từ...đến...)
-    if typ == "interval":
-        start_iso = primary.get("from", {}).get("value")
-        end_iso = primary.get("to", {}).get("value")
-        # Nếu muốn inclusive end theo grain (nếu Duckling trả grain ở from/to)
-        if inclusive_end and end_iso:
-            # Cố gắng dùng grain nếu có ở 'to', nếu không dùng 'day'
-            end_grain = primary.get("to", {}).get("grain") or grain or "day"
-            if end_grain in ("day", "week", "month", "quarter", "year"):
-                _s, end_iso = _expand_grain_interval(end_iso, end_grain, inclusive_end=True, tz=tz)
-        return {"type": "range", "start": start_iso, "end": end_iso}
-
-    # Value (mốc đơn). Với grain rộng → đổi thành range
-    if typ == "value":
-        val_iso = primary.get("value")
-        if grain in ("week", "month", "quarter", "year"):
-            start, end = _expand_grain_interval(val_iso, grain, inclusive_end=inclusive_end, tz=tz)
-            return {"type": "range", "start": start, "end": end, "grain": grain}
-        return {"type": "single", "date": val_iso, "grain": grain}
-
-    return {"type": "none"}
-
-def build_response_with_time(text: str):
-    intent, confidence = predict_intent(text)
-
-    time_info = {"type": "none"}
-    # Nếu intent liên quan thời gian thì gọi Duckling
-    if "NGAY" in intent:
-        duck_resp = duckling_parse_time(text)
-        print(duck_resp)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("duckling.response", extra={"fields": {"text": text, "response": duck_resp}})
+    with STAGE_SECONDS.time("normalize"):
         time_info = normalize_duckling_times(duck_resp)
-
-    action_text = get_action(intent, text)
-    return {
+    if time_info.get("grain") not in ("hour", "minute", "second"):
+        time_cache.set(key, time_info, expires_at=_next_local_midnight(now).timestamp())
+    return time_info
+
+def build_response_with_time(text: str, employee_id: Optional[str] = None):
+    speculative = None
+    if SPECULATIVE_TIME and has_time_hint(text):
+        time_stats["speculative_started"] += 1
+        # Greenlet mới không kế thừa contextvars: chạy trong bản sao context để giữ request_id
+        speculative = gevent.spawn(contextvars.copy_context().run, resolve_time, text)
+        gevent.sleep(0)  # cho greenlet gửi request Duckling trước khi predict
+    (intent, confidence, version, extra), = _nn_fallback([text], [_predict_one(text)])
+    return _build_response(text, intent, confidence, version, speculative, extra, employee_id)
+
+def build_responses_with_time(texts: list, employee_id: Optional[str] = None):
+    """
+    Xử lý nhiều câu một lượt: phân loại toàn bộ trong 1 lần model.predict,
+    chỉ gọi Duckling cho những câu có intent chứa "NGAY". Giữ nguyên thứ tự.
+    """
+    predictions = _nn_fallback(texts, _predict_many(texts))
+    return [
+        _build_response(text, intent, confidence, version, extra=extra, employee_id=employee_id)
+        for text, (intent, confidence, version, extra) in zip(texts, predictions)
+    ]
+
+def _build_response(text: str, intent: str, confidence: float, model_version: str, speculative=None, extra=None,
+                    employee_id=None):
+    """
+    speculative: greenlet resolve_time(text) đã chạy song song với predict (nếu có)
+    extra: trường thêm vào response (gợi ý từ nn_index)
+    employee_id: có thì câu trả lời chấm công / nghỉ phép lấy từ attendance
+    """
+    time_info = _time_for_intent(text, intent, speculative)
+    summary = None
+    if employee_id and attendance is not None and intent in ATTENDANCE_INTENTS:
+        with STAGE_SECONDS.time("attendance"):
+            action_text, summary = attendance_reply(attendance, intent, str(employee_id),
+                                                    *templates.period(intent, time_info))
+    else:
+        with STAGE_SECONDS.time("template"):
+            action_text = get_action(intent, text, time_info)
+    PREDICTIONS.inc(intent, _confidence_bucket(confidence))
+    res = {
         "intent": intent,
         "confidence": confidence,
         "time": time_info,
         "message": action_text,
+        "model_version": model_version,
     }
+    if summary is not None:
+        res["attendance"] = summary
+    if extra:
+        res.update(extra)
+    return res
+
+def _time_for_intent(text: str, intent: str, speculative=None):
+    time_info = {"type": "none"}
+    # Nếu intent liên quan thời gian thì gọi Duckling
+    if "NGAY" in intent:
+        if speculative is not None:
+            time_stats["speculative_used"] += 1
+            time_info = speculative.get()
+        elif TIME_PREFILTER and not has_time_hint(text):
+            # "xem chấm công", "phép năm còn lại": không nêu ngày → khoảng mặc định của intent
+            time_stats["skipped"] += 1
+            time_info = templates.default_time_info(intent) or {"type": "none"}
+        else:
+            time_info = resolve_time(text)
+    elif speculative is not None:
+        # Không huỷ: để lời gọi Duckling kết thúc bình thường (kết quả vẫn vào time_cache)
+        time_stats["speculative_wasted"] += 1
+    return time_info
+
+def _ndjson(event) -> str:
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def stream_response_with_time(text: str, employee_id=None):
+    """
+    Như build_response_with_time nhưng trả về iterator các dòng NDJSON. Phần đầu
+    (intent, time, câu mở đầu) được tính ngay; bảng chấm công / nghỉ phép được đọc
+    dần từ attendance khi ghi ra socket nên bộ nhớ không tăng theo độ dài khoảng ngày.
+    Intent không có bảng theo khoảng ngày (hôm nay / hôm qua, hoặc không có dữ liệu):
+    một dòng duy nhất = response thường.
+    """
+    (intent, confidence, version, extra), = _nn_fallback([text], [_predict_one(text)])
+    if not (employee_id and attendance is not None and intent in STREAM_INTENTS):
+        return iter([_ndjson(_build_response(text, intent, confidence, version, extra=extra, employee_id=employee_id))])
+
+    time_info = _time_for_intent(text, intent)
+    PREDICTIONS.inc(intent, _confidence_bucket(confidence))
+    head = {"intent": intent, "confidence": confidence, "time": time_info, "model_version": version, **(extra or {})}
+    events = stream_reply(attendance, intent, str(employee_id), *templates.period(intent, time_info), head)
+    first = _ndjson(next(events))
+
+    def lines():
+        yield first
+        batch = []
+        for event in events:
+            batch.append(_ndjson(event))
+            if len(batch) >= STREAM_BATCH_ROWS:
+                yield "".join(batch)
+                batch = []
+        if batch:
+            yield "".join(batch)
+    return lines()
 
 def predict_intent(text):
     """Dự đoán intent với xử lý lỗi"""
+    intent, confidence, _version = _predict_one(text)
+    return intent, confidence
+
+def predict_intents(texts, k=1):
+    """Dự đoán intent cho cả danh sách câu; các câu chưa có trong cache được predict trong 1 lần gọi model.predict"""
+    return [(intent, confidence) for intent, confidence, _version in _predict_many(texts, k=k)]
+
+def _predict_one(text):
+    """(intent, confidence, model_version) cho 1 câu, qua cache và micro-batching"""
+    key = canonical_text(text)
+    known = _keyword_lookup(key)
+    if known is not None:
+        return known
+    _sync_intent_cache()
+    cached = intent_cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = None
+    if batcher is not None:
+        try:
+            result = batcher.submit(key)
+        except Exception as e:
+            return "UNKNOWN", 0.0, model_manager.current.version
+        # None: hàng đợi đầy → predict trực tiếp
+    if result is None:
+        result = _model_predict([key])[0]
+    _cache_intent(key, result)
+    return result
+
+def _predict_many(texts, k=1):
+    keys = [canonical_text(t) for t in texts]
+    _sync_intent_cache()
+    results = {}
+    misses = []
+    for key in keys:
+        if key in results:
+            continue
+        known = _keyword_lookup(key)
+        if known is not None:
+            results[key] = known
+            continue
+        cached = intent_cache.get(key)
+        if cached is not None:
+            results[key] = cached
+        else:
+            results[key] = None
+            misses.append(key)
+    for key, result in zip(misses, _model_predict(misses, k=k)):
+        results[key] = result
+        _cache_intent(key, result)
+    return [results[key] for key in keys]
+
+def _keyword_lookup(key):
+    """(intent, 1.0, model_version) nếu keyword_index biết câu này, không thì None"""
+    if keyword_index is None:
+        return None
+    label = keyword_index.lookup(key)
+    snapshot = model_manager.current
+    if label is None or label not in _model_labels(snapshot):
+        return None
+    return label, 1.0, snapshot.version
+
+def _nn_fallback(texts, predictions):
+    """[(intent, confidence, version)] → [(intent, confidence, version, extra)], xem nn_index.low_confidence_fallback"""
+    if not NN_FALLBACK:
+        return [(*p, None) for p in predictions]
+    snapshot = model_manager.current
+    index = _current_nn_index(snapshot)
+    if index is None:
+        return [(*p, None) for p in predictions]
+    with STAGE_SECONDS.time("nn_search"):
+        return low_confidence_fallback(index, snapshot.model, texts, predictions,
+                                       NN_CONFIDENCE_THRESHOLD, NN_K, NN_MIN_SIMILARITY)
+
+def _model_predict(texts, k=1):
+    """Gọi model.predict 1 lần cho cả danh sách câu (không qua cache), trên cùng 1 snapshot model"""
+    if not texts:
+        return []
+    snapshot = model_manager.current
+    version = snapshot.version
+    # fastText không nhận ký tự xuống dòng trong câu đầu vào
+    lines = [t.replace('\n', ' ').replace('\r', ' ') for t in texts]
+    try:
+        with STAGE_SECONDS.time("fasttext"):
+            labels, probs = snapshot.model.predict(lines, k=k)
+    except Exception as e:
+        return [("UNKNOWN", 0.0, version)] * len(texts)
+    results = []
+    for lbls, ps in zip(labels, probs):
+        if not lbls:
+            results.append(("UNKNOWN", 0.0, version))
+            continue
+        results.append((lbls[0].replace('__label__', ''), float(ps[0]), version))
+    return results
+
+
+intent_cache = LRUCache(INTENT_CACHE_SIZE)
+_intent_cache_version = model_manager.current.version  # model mà nội dung intent_cache được tính từ
+
+def _sync_intent_cache():
+    """Xoá cache khi model đang phục vụ đã đổi"""
+    global _intent_cache_version
+    version = model_manager.current.version
+    if _intent_cache_version != version:
+        intent_cache.clear()
+        _intent_cache_version = version
+
+def _cache_intent(key, result):
+    # Không cache lỗi, cũng không cache kết quả của model cũ vừa bị thay
+    if result[0] != "UNKNOWN" and result[2] == _intent_cache_version:
+        intent_cache.set(key, result)
+
+def _load_nn_index(snapshot):
+    global nn_index
     try:
-        predictions = model.predict(text, k=1)
-        intent = predictions[0][0].replace('__label__', '')
-        confidence = predictions[1][0]
-        return intent, confidence
+        nn_index = NearestNeighbourIndex.load_or_build(snapshot.model, snapshot.path, snapshot.version)
     except Exception as e:
-        return "UNKNOWN", 0.0
-
-def get_action(intent, text=""):
-    actions = {
-        "WELCOME": """Chào bạn nha! 👋 
-        Tôi có thể giúp bạn các việc sau:
-        📊 **Xem lương** - Xem bảng lương cá nhân
-        📅 **Xem chấm công** - Xem thông tin chấm công
-        👤 **Xem thông tin cá nhân** - Xem hồ sơ cá nhân
-        📋 **Xem ngày nghỉ** - Xem thông tin nghỉ phép
-
-        💡 **Ví dụ cách hỏi:**
-        - "Cho tôi xem lương tháng này"
-        - "Xem chấm công từ 1/10 đến 31/10"  
-        - "Hiển thị thông tin cá nhân"
-        - "Chấm công tháng trước"
-
-        Hãy cho tôi biết bạn cần gì nhé! 😊""",
-        
-        "HELP_INFORMATION": """Xin chào, tôi là TimeAI! 🤖
-        Tôi có thể giúp bạn những thông tin:
-        • 📋 **Thông tin cá nhân** - Họ tên, mã NV, phòng ban, chức vụ
-        • 📅 **Thông tin ngày công** - Chấm công, giờ làm, tăng ca  
-        • 🏖️ **Thông tin ngày nghỉ** - Phép năm, ngày vắng
-        • 💰 **Thông tin lương tháng** - Bảng lương, thu nhập
-
-        Bạn muốn xem thông tin nào?""",
-        
-        "HELP_PERSONAL": """Tôi có thể hỗ trợ thông tin liên quan đến thông tin cá nhân của bạn: 
-        • 👤 Họ tên
-        • 🔢 Mã nhân viên  
-        • 🏢 Phòng ban
-        • 💼 Chức vụ
-        • 📝 Công việc
-
-        Bạn muốn xem thông tin cụ thể nào?""",
-        
-        "NGAYCONG_MON": """Vâng, đây là dữ liệu chấm công của bạn từ đầu tháng đến hôm nay:
-
-    📊 **Bảng chấm công tháng 10/2025**
-        Ngày làm việc Ca làm việc Giờ vào Giờ ra Giờ làm Giờ tăng ca Loại vắng Số giờ vắng
-        05/10/2025 08:00-17:00 08:00 17:40 8 0 - -
-        06/10/2025 08:00-17:00 07:55 18:30 8 1 - -
-        07/10/2025 08:00-17:00 - - - - Phép năm 8""",
-    "NGAYCONG_TODAY": f"""Vâng, đây là dữ liệu chấm công của bạn ngày hôm nay:
-
-        📅 **Ngày làm việc**: {datetime.now().strftime('%d/%m/%Y')} 
-        ⏰ **Ca làm việc**: 08:00 - 17:00 (nghỉ trưa 12:00-13:00)
-        🟢 **Giờ vào**: 08:10  
-        🔴 **Giờ ra**: Chưa có
-        💡 **Trạng thái**: Đang làm việc""",
-                
-        "NGAYCONG_YESTERDAY": """Vâng, đây là dữ liệu chấm công của bạn ngày hôm qua:
-
-        📅 **Ngày làm việc**: 19/10/2025 (Thứ 4)
-        ⏰ **Ca làm việc**: 08:00 - 17:00 (nghỉ trưa 12:00-13:00)
-        🟢 **Giờ vào**: 08:15 (Trễ 15 phút)
-        🔴 **Giờ ra**: 17:10
-        ⏱️ **Giờ làm việc**: 7.5
-        🌙 **Giờ tăng ca thực tế**: 2
-        ✅ **Giờ tăng ca được duyệt**: 2
-        ❌ **Giờ vắng**: Không có
-        📋 **Loại vắng**: Không có""",
-        
-        "NGAYCONG_FROMTO": """Vâng, đây là dữ liệu chấm công của bạn từ ngày 05/10/2025 đến 30/10/2025:
-
-    📊 **Bảng chấm công**
-        Ngày làm việc Ca làm việc Giờ vào Giờ ra Giờ làm Giờ tăng ca Loại vắng Số giờ vắng
-        05/10/2025 08:00-17:00 08:00 17:40 8 0 - -
-        06/10/2025 08:00-17:00 07:55 18:30 8 1 - -
-        07/10/2025 08:00-17:00 - - - - Phép năm 8
-        ... (các ngày khác)
-
-""","NGAYPHEPNAM_YEAR": """Vâng, đây là dữ liệu chi tiết về ngày nghỉ phép năm của bạn:
-
-    📋 **Phép năm đã sử dụng:**
-        • 📅 05/01/2025 : 8 giờ
-        • 📅 12/02/2025 : 4 giờ  
-        • 📅 25/04/2025 : 8 giờ
-
-    📊 **Tổng kết:**
-        • ✅ Tổng đã nghỉ phép năm: 20 giờ
-        • 🎯 Phép năm còn lại: 2 ngày (16 giờ)""",
-        
-        "NGAYPHEPNAM_FROMTO": """Vâng, đây là dữ liệu chi tiết về ngày nghỉ phép năm từ ngày 01/05/2025 đến 30/10/2025 của bạn:
-
-    📋 **Phép năm trong khoảng thời gian:**
-        • 📅 05/01/2025 : 8 giờ
-        • 📅 12/02/2025 : 4 giờ
-        • 📅 25/04/2025 : 8 giờ
-
-    📊 **Tổng kết:**
-        • ✅ Tổng đã nghỉ phép năm: 20 giờ
-        • 🎯 Phép năm còn lại: 2 ngày (16 giờ)""",
-        
-        "NGAYNGHI_YEAR": """Vâng, đây là dữ liệu ngày nghỉ của bạn trên hệ thống ghi nhận từ đầu năm đến nay:
-
-    📊 **Bảng ngày nghỉ**
-        Ngày làm việc Ca làm việc Loại vắng Số giờ vắng
-        05/10/2025 08:00-17:00 Phép năm 8
-        06/10/2025 08:00-17:00 Không phép 8
-        07/10/2025 08:00-17:00 Phép năm 4
-
-"""}
-    return actions.get(intent, "Xin lỗi, tôi chưa hiểu yêu cầu của bạn. Hãy thử lại nhé! 😊")
+        log.error("nn_index.load_failed", extra={"fields": {"version": snapshot.version, "error": str(e)}})
+
+def _current_nn_index(snapshot):
+    """Index của model đang phục vụ; model vừa đổi thì load/build index mới ở nền (1 lần) và tạm trả None"""
+    global _nn_index_requested
+    if nn_index is not None and nn_index.model_version == snapshot.version:
+        return nn_index
+    if _nn_index_requested != snapshot.version:
+        _nn_index_requested = snapshot.version
+        gevent.get_hub().threadpool.spawn(_load_nn_index, snapshot)
+    return None
+
+# Load (mmap) lúc khởi động, trước khi fork worker: các worker dùng chung page cache
+nn_index = None
+_nn_index_requested = model_manager.current.version  # version đã load/build index (thành công hay không)
+if NN_FALLBACK:
+    _load_nn_index(model_manager.current)
+
+batcher = None
+if MICROBATCH_ENABLED:
+    from microbatch import MicroBatcher
+    batcher = MicroBatcher(
+        _model_predict,
+        max_batch_size=MICROBATCH_MAX_SIZE,
+        max_wait_ms=MICROBATCH_MAX_WAIT_MS,
+        max_queue=MICROBATCH_MAX_QUEUE,
+    )
+
+def get_action(intent, text="", time_info=None):
+    return templates.render(intent, time_info)
+
+@app.before_request
+def assign_request_id():
+    # Dùng X-Request-ID của client/proxy nếu có để nối log giữa các service
+    request_id_var.set(request.headers.get("X-Request-ID") or new_request_id())
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers["X-Request-ID"] = request_id_var.get() or ""
+    return response
 
 # Demo
 @app.after_request
@@ -299,16 +471,148 @@ def add_cors_headers(response):
     response.headers["Access-Control-Allow-Headers"] = "Content-Type,Authorization"
     return response
 
+def _employee_id():
+    """Mã nhân viên đã xác thực (header của proxy), None nếu tắt hoặc không có"""
+    return (request.headers.get(EMPLOYEE_ID_HEADER) or None) if EMPLOYEE_ID_HEADER else None
+
+def _observe_stream(lines, start):
+    """REQUEST_SECONDS tính tới khi gửi xong dòng cuối (hoặc client ngắt), không chỉ phần đầu"""
+    try:
+        yield from lines
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, "predict")
+
 @app.route('/predict', methods=['POST'])
 def predict():
     data = request.json
-    text = data.get('text', '')
-    
-    res = build_response_with_time(text)
-    
-    return jsonify(res)
+    if data.get('stream') or request.headers.get('Accept') == NDJSON_MIMETYPE:
+        start = time.perf_counter()
+        try:
+            lines = stream_response_with_time(data.get('text', ''), _employee_id())
+        except Exception:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, "predict")
+            raise
+        return Response(_observe_stream(lines, start), mimetype=NDJSON_MIMETYPE)
+
+    with REQUEST_SECONDS.time("predict"):
+        text = data.get('text', '')
+        res = build_response_with_time(text, _employee_id())
+
+        with STAGE_SECONDS.time("serialize"):
+            return jsonify(res)
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    data = request.get_json(silent=True) or {}
+    texts = data.get('texts')
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({"error": "'texts' phải là danh sách chuỗi"}), 400
+    if len(texts) > MAX_BATCH_TEXTS:
+        return jsonify({"error": f"Tối đa {MAX_BATCH_TEXTS} câu mỗi request"}), 400
+
+    with REQUEST_SECONDS.time("predict_batch"):
+        results = build_responses_with_time(texts, _employee_id())
+        with STAGE_SECONDS.time("serialize"):
+            return jsonify({"results": results})
+
+def admin_reload():
+    """Load lại model_manager.path (không nhận đường dẫn từ client); chi tiết lỗi chỉ ghi log."""
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        version = model_manager.reload()
+    except ModelValidationError as e:
+        log.warning("admin.reload_rejected", extra={"fields": {"error": str(e)}})
+        return jsonify({"error": "Model mới không đạt smoke test"}), 409
+    except Exception as e:
+        log.error("admin.reload_failed", extra={"fields": {"error": f"{type(e).__name__}: {e}"}})
+        return jsonify({"error": "Không load được model"}), 500
+    return jsonify({"model_version": version})
+
+if ADMIN_TOKEN:
+    app.add_url_rule('/admin/reload', view_func=admin_reload, methods=['POST'])
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "model": model_manager.stats(),
+        "microbatch": batcher.stats() if batcher is not None else None,
+        "duckling": duckling.stats(),
+        "keyword_index": keyword_index.stats() if keyword_index is not None else None,
+        "nn_index": nn_index.stats() if nn_index is not None else None,
+        "attendance": attendance.stats() if attendance is not None else None,
+        "intent_cache": intent_cache.stats(),
+        "time_cache": time_cache.stats(),
+        "time_parse": time_stats,
+        "relative_dates": relative_dates.stats(),
+        "logging": logging_stats(),
+    })
+
+def _cache_metrics(field):
+    return lambda: [((name,), cache.stats()[field]) for name, cache in (("intent", intent_cache), ("time", time_cache))]
+
+metrics.callback("intent_api_cache_hits_total", "Số lần tra cache trúng", _cache_metrics("hits"), "counter", ("cache",))
+metrics.callback("intent_api_cache_misses_total", "Số lần tra cache trượt", _cache_metrics("misses"), "counter", ("cache",))
+metrics.callback("intent_api_cache_hit_ratio", "Tỉ lệ trúng cache", _cache_metrics("hit_ratio"), "gauge", ("cache",))
+metrics.callback("intent_api_cache_size", "Số entry trong cache", _cache_metrics("size"), "gauge", ("cache",))
+metrics.callback(
+    "intent_api_duckling_requests_total", "Lời gọi Duckling theo kết quả",
+    lambda: [((key,), value) for key, value in duckling.stats().items() if key != "breaker_state"],
+    "counter", ("result",))
+metrics.callback(
+    "intent_api_duckling_breaker_state", "Trạng thái circuit breaker của Duckling (1 = đang ở trạng thái này)",
+    lambda: [((state,), int(duckling.breaker.state == state)) for state in ("closed", "open", "half_open")],
+    "gauge", ("state",))
+metrics.callback(
+    "intent_api_time_parse_total", "Số lần parse thời gian theo đường xử lý",
+    lambda: [((path,), value) for path, value in time_stats.items()], "counter", ("path",))
+if keyword_index is not None:
+    metrics.callback(
+        "intent_api_keyword_index_total", "Số lần tra keyword_index theo kết quả (exact, keyword, miss)",
+        lambda: [(("exact",), keyword_index.exact_hits), (("keyword",), keyword_index.keyword_hits),
+                 (("miss",), keyword_index.misses)],
+        "counter", ("result",))
+if NN_FALLBACK:
+    metrics.callback("intent_api_nn_queries_total", "Số câu confidence thấp được tra nn_index",
+                     lambda: nn_index.queries if nn_index is not None else 0, "counter")
+    metrics.callback("intent_api_nn_overridden_total", "Số lần label kNN thay cho label của model",
+                     lambda: nn_index.overridden if nn_index is not None else 0, "counter")
+metrics.callback("intent_api_model_info", "Model đang phục vụ",
+                 lambda: [((model_manager.current.version,), 1)], "gauge", ("version",))
+
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype=METRICS_CONTENT_TYPE)
+
+if WORKERS == 1:
+    app.add_url_rule('/metrics', view_func=prometheus_metrics, methods=['GET'])
+
+def _metrics_app(environ, start_response):
+    """WSGI app riêng của một worker pre-fork: chỉ có GET /metrics"""
+    if environ.get('PATH_INFO') != '/metrics':
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'not found']
+    body = metrics.render().encode('utf-8')
+    start_response('200 OK', [('Content-Type', METRICS_CONTENT_TYPE), ('Content-Length', str(len(body)))])
+    return [body]
+
+def _start_background_tasks(worker=None):
+    global _worker_index
+    if worker is not None:
+        from gevent.pywsgi import WSGIServer
+        _worker_index = worker
+        WSGIServer(('', METRICS_PORT + worker), _metrics_app, log=None).start()
+    relative_dates.start_refresher()
+    if MODEL_WATCH_INTERVAL > 0:
+        model_manager.watch(MODEL_WATCH_INTERVAL)
 
 if __name__ == '__main__':
     from gevent.pywsgi import WSGIServer
-    http_server = WSGIServer(('', 5000), app)
-    http_server.serve_forever()
\ No newline at end of file
+    if WORKERS > 1:
+        # Model/templates/cache đã load ở master, các worker dùng chung copy-on-write
+        from prefork import serve_prefork
+        serve_prefork(app, ('', PORT), WORKERS, on_worker_start=_start_background_tasks,
+                      graceful_timeout=GRACEFUL_TIMEOUT)
+    else:
+        _start_background_tasks()
+        http_server = WSGIServer(('', PORT), app)
+        http_server.serve_forever()
\ No newline at end of file
@@ -1,41 +1,24 @@
-import fasttext # type: ignore
 import re
-import requests # type: ignore
 from datetime import datetime, timezone, timedelta
 from typing import Optional
+from duckling_client import DucklingClient
+from model_utils import load_intent_model
 # Load model
-model = fasttext.load_model('models/intent_model.bin')
+model = load_intent_model()  # .bin hoặc .ftz, xem model_utils.resolve_model_path
 DUCKLING_URL = "http://localhost:8085/parse"
 VI_LOCALE = "vi_VN"
 TZ = timezone(timedelta(hours=7))  # Asia/Ho_Chi_Minh
+duckling = DucklingClient(DUCKLING_URL, VI_LOCALE)
 
-def duckling_parse_time(text: str, ref_time: Optional[datetime] = None):
+def duckling_parse_time(text: str, ref_time: Optional[datetime] = None, deadline: Optional[float] = None):
     """
     Gọi Duckling server để parse ngày/giờ.
+    deadline: mốc time.monotonic() phải có kết quả (mặc định chỉ dùng timeout của client).
     """
     if ref_time is None:
         ref_time = datetime.now(TZ)
     print("Duckling đang xử lí")
-    reftime_ms = int(ref_time.timestamp() * 1000)
-    # Duckling yêu cầu body x-www-form-urlencoded, không phải JSON
-    data = {
-        "locale": VI_LOCALE,
-        "text": text,
-        "dims": '["time"]',
-        "reftime": str(reftime_ms),
-    }
-    try:
-        r = requests.post(
-            DUCKLING_URL,
-            data=data,  # form-urlencoded
-            headers={"Content-Type": "application/x-www-form-urlencoded; charset=UTF-8"},
-            timeout=5
-        )
-        r.raise_for_status()
-        return r.json()
-    except Exception as e:
-        print("Duckling error:", e)
-        return []
+    return duckling.parse(text, ref_time=ref_time, deadline=deadline)
 
 def _iso_to_dt(s: str) -> datetime:
     # Hỗ trợ cả 'Z'
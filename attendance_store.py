@@ -0,0 +1,361 @@
+"""
+Dữ liệu chấm công / nghỉ phép theo nhân viên, thay cho bảng mẫu trong templates
+cho các intent NGAYCONG_* / NGAYPHEPNAM_* / NGAYNGHI_YEAR.
+
+Lưu dạng cột (mỗi cột một mảng NumPy), các dòng xếp theo (nhân viên, ngày):
+dòng của một nhân viên nằm liền nhau trong [bounds[i], bounds[i+1]), ngày tăng dần.
+Truy vấn khoảng ngày = 2 lần searchsorted trên đoạn đó, tổng hợp (giờ làm, tăng
+ca, vắng, phép năm) = sum/bincount trên slice, không lặp từng dòng trong Python.
+
+Nạp từ CSV (có header):
+
+    employee_id,date,shift,check_in,check_out,worked_hours,overtime_hours,absence_type,absence_hours
+    NV001,2025-10-05,08:00-17:00,08:00,17:40,8,0,,0
+    NV001,2025-10-07,08:00-17:00,,,0,0,Phép năm,8
+
+Số giờ phép năm được hưởng: file leave_balances.csv (employee_id,year,entitled_hours)
+cạnh file chấm công nếu có, không thì ANNUAL_LEAVE_HOURS cho mọi người.
+
+save()/load() ghi mỗi cột thành một file .npy trong thư mục; load() dùng mmap nên
+các worker pre-fork dùng chung page cache.
+
+    python attendance_store.py data/attendance.csv --output data/attendance   # CSV → .npy
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+ANNUAL_LEAVE = "Phép năm"
+ANNUAL_LEAVE_HOURS = float(os.environ.get("ANNUAL_LEAVE_HOURS", "96"))  # 12 ngày x 8 giờ
+DATE_FMT = "%d/%m/%Y"
+_WEEKDAYS = ("Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ nhật")
+_EPOCH = date(1970, 1, 1)
+_COLUMNS = ("day", "shift", "check_in", "check_out", "worked", "overtime", "absence", "absence_hours")
+
+
+def _day_number(value) -> int:
+    """date/datetime → số ngày kể từ 1970-01-01 (datetime có tz được lấy theo ngày địa phương)."""
+    if isinstance(value, datetime):
+        value = value.date()
+    return (value - _EPOCH).days
+
+
+def _minutes(value: str) -> int:
+    """'08:15' → 495; rỗng → -1."""
+    if not value:
+        return -1
+    hour, _, minute = value.partition(':')
+    return int(hour) * 60 + int(minute or 0)
+
+
+def _hhmm(minutes) -> str:
+    return "-" if minutes < 0 else f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _hours(value) -> str:
+    return f"{float(value):g}"
+
+
+class AttendanceStore:
+    def __init__(self, columns: dict, employees, shifts, absence_types, entitlements=None):
+        """
+        columns: các mảng cùng độ dài theo _COLUMNS, đã xếp theo (nhân viên, ngày).
+        employees: list employee_id theo thứ tự block; columns["bounds"] dài len(employees) + 1.
+        shifts / absence_types: bảng tra mã → tên (absence_types[0] = "" = không vắng).
+        """
+        for name in _COLUMNS + ("bounds",):
+            setattr(self, name, columns[name])
+        self.employees = list(employees)
+        self.employee_index = {employee_id: i for i, employee_id in enumerate(self.employees)}
+        self.shifts = list(shifts)
+        self.absence_types = list(absence_types)
+        self.annual_leave_code = self.absence_types.index(ANNUAL_LEAVE) if ANNUAL_LEAVE in self.absence_types else -1
+        self.entitlements = dict(entitlements or {})  # (employee_id, year) -> số giờ phép năm
+
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def __len__(self):
+        return len(self.day)
+
+    # ------------------------------------------------------------ nạp / lưu
+
+    @classmethod
+    def from_csv(cls, path: str, balances_path: str = None):
+        shift_codes = {}
+        absence_codes = {"": 0}
+        employee_codes = {}
+        rows = {name: [] for name in _COLUMNS}
+        employee_col = []
+        with open(path, encoding='utf-8', newline='') as f:
+            for rec in csv.DictReader(f):
+                employee_col.append(employee_codes.setdefault(rec["employee_id"].strip(), len(employee_codes)))
+                rows["day"].append(_day_number(date.fromisoformat(rec["date"].strip())))
+                rows["shift"].append(shift_codes.setdefault((rec.get("shift") or "").strip(), len(shift_codes)))
+                rows["check_in"].append(_minutes((rec.get("check_in") or "").strip()))
+                rows["check_out"].append(_minutes((rec.get("check_out") or "").strip()))
+                rows["worked"].append(float(rec.get("worked_hours") or 0))
+                rows["overtime"].append(float(rec.get("overtime_hours") or 0))
+                rows["absence"].append(absence_codes.setdefault((rec.get("absence_type") or "").strip(),
+                                                                len(absence_codes)))
+                rows["absence_hours"].append(float(rec.get("absence_hours") or 0))
+
+        dtypes = {"day": np.int32, "shift": np.int16, "check_in": np.int16, "check_out": np.int16,
+                  "worked": np.float32, "overtime": np.float32, "absence": np.int16, "absence_hours": np.float32}
+        employee_col = np.asarray(employee_col, dtype=np.int32)
+        columns = {name: np.asarray(values, dtype=dtypes[name]) for name, values in rows.items()}
+        order = np.lexsort((columns["day"], employee_col))  # xếp theo nhân viên rồi tới ngày
+        columns = {name: np.ascontiguousarray(values[order]) for name, values in columns.items()}
+        # employee code = thứ tự xuất hiện trong file, đã sort nên block i là nhân viên code i
+        columns["bounds"] = np.searchsorted(employee_col[order], np.arange(len(employee_codes) + 1)).astype(np.int64)
+
+        balances_path = balances_path or os.path.join(os.path.dirname(path), 'leave_balances.csv')
+        entitlements = {}
+        if os.path.exists(balances_path):
+            with open(balances_path, encoding='utf-8', newline='') as f:
+                for rec in csv.DictReader(f):
+                    entitlements[(rec["employee_id"].strip(), int(rec["year"]))] = float(rec["entitled_hours"])
+        return cls(columns, employee_codes, shift_codes, absence_codes, entitlements)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in _COLUMNS + ("bounds",):
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        meta = {
+            "employees": self.employees,
+            "shifts": self.shifts,
+            "absence_types": self.absence_types,
+            "entitlements": [[employee_id, year, hours] for (employee_id, year), hours in self.entitlements.items()],
+        }
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str):
+        """Thư mục đã save() (mmap) hoặc file .csv."""
+        if path.endswith('.csv'):
+            return cls.from_csv(path)
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in _COLUMNS + ("bounds",)}
+        entitlements = {(employee_id, year): hours for employee_id, year, hours in meta["entitlements"]}
+        return cls(columns, meta["employees"], meta["shifts"], meta["absence_types"], entitlements)
+
+    # ------------------------------------------------------------ truy vấn
+
+    def rows(self, employee_id: str, start, end):
+        """[lo, hi) các dòng của nhân viên có ngày trong [start, end] (inclusive); (0, 0) nếu không có."""
+        i = self.employee_index.get(employee_id)
+        if i is None:
+            return 0, 0
+        block_lo, block_hi = int(self.bounds[i]), int(self.bounds[i + 1])
+        days = self.day[block_lo:block_hi]
+        lo = block_lo + int(np.searchsorted(days, _day_number(start), side='left'))
+        hi = block_lo + int(np.searchsorted(days, _day_number(end), side='right'))
+        return lo, max(lo, hi)
+
+    def summary(self, employee_id: str, start, end) -> dict:
+        t0 = time.perf_counter()
+        lo, hi = self.rows(employee_id, start, end)
+        worked = self.worked[lo:hi]
+        absence = self.absence[lo:hi]
+        absence_hours = self.absence_hours[lo:hi]
+        by_type = np.bincount(absence, weights=absence_hours, minlength=len(self.absence_types))
+        result = {
+            "days": hi - lo,
+            "days_worked": int(np.count_nonzero(worked > 0)),
+            "worked_hours": round(float(worked.sum()), 2),
+            "overtime_hours": round(float(self.overtime[lo:hi].sum()), 2),
+            "absence_days": int(np.count_nonzero(absence)),
+            "absence_hours": round(float(absence_hours.sum()), 2),
+            "absence_by_type": {self.absence_types[code]: round(float(hours), 2)
+                                for code, hours in enumerate(by_type) if code and hours},
+        }
+        self.queries += 1
+        self.query_seconds += time.perf_counter() - t0
+        return result
+
+    def leave_balance(self, employee_id: str, year: int) -> dict:
+        """Phép năm (giờ) của năm: được hưởng, đã dùng, còn lại."""
+        lo, hi = self.rows(employee_id, date(year, 1, 1), date(year, 12, 31))
+        used = 0.0
+        if self.annual_leave_code >= 0:
+            mask = self.absence[lo:hi] == self.annual_leave_code
+            used = float(self.absence_hours[lo:hi][mask].sum())
+        entitled = self.entitlements.get((employee_id, year), ANNUAL_LEAVE_HOURS)
+        return {"year": year, "entitled_hours": entitled, "used_hours": round(used, 2),
+                "remaining_hours": round(max(0.0, entitled - used), 2)}
+
+    def iter_days(self, employee_id: str, start, end, absences_only=False, absence_type=None):
+        """Từng ngày trong khoảng dưới dạng dict (đọc dần từ mảng, không dựng cả bảng)."""
+        lo, hi = self.rows(employee_id, start, end)
+        indices = range(lo, hi)
+        if absence_type is not None:
+            if absence_type not in self.absence_types:
+                return
+            indices = lo + np.flatnonzero(self.absence[lo:hi] == self.absence_types.index(absence_type))
+        elif absences_only:
+            indices = lo + np.flatnonzero(self.absence[lo:hi])
+        for i in indices:
+            absence = int(self.absence[i])
+            yield {
+                "date": date.fromordinal(_EPOCH.toordinal() + int(self.day[i])),
+                "shift": self.shifts[self.shift[i]],
+                "check_in": _hhmm(int(self.check_in[i])),
+                "check_out": _hhmm(int(self.check_out[i])),
+                "worked_hours": float(self.worked[i]),
+                "overtime_hours": float(self.overtime[i]),
+                "absence_type": self.absence_types[absence],
+                "absence_hours": float(self.absence_hours[i]),
+            }
+
+    def stats(self):
+        return {
+            "rows": len(self),
+            "employees": len(self.employees),
+            "mmap": isinstance(self.day, np.memmap),
+            "queries": self.queries,
+            "avg_query_ms": round(self.query_seconds / self.queries * 1000, 4) if self.queries else 0.0,
+        }
+
+
+# ---------------------------------------------------------------- câu trả lời
+
+ATTENDANCE_INTENTS = ("NGAYCONG_TODAY", "NGAYCONG_YESTERDAY", "NGAYCONG_MON", "NGAYCONG_FROMTO",
+                      "NGAYPHEPNAM_YEAR", "NGAYPHEPNAM_FROMTO", "NGAYNGHI_YEAR")
+# Intent trả lời bằng bảng theo khoảng ngày (stream_reply); hôm nay / hôm qua chỉ một ngày
+STREAM_INTENTS = tuple(i for i in ATTENDANCE_INTENTS if i not in ("NGAYCONG_TODAY", "NGAYCONG_YESTERDAY"))
+
+
+def _timesheet_line(day: dict) -> str:
+    if day["absence_type"] and not day["worked_hours"]:
+        return (f"{day['date'].strftime(DATE_FMT)} {day['shift']} - - - - "
+                f"{day['absence_type']} {_hours(day['absence_hours'])}")
+    return (f"{day['date'].strftime(DATE_FMT)} {day['shift']} {day['check_in']} {day['check_out']} "
+            f"{_hours(day['worked_hours'])} {_hours(day['overtime_hours'])} "
+            f"{day['absence_type'] or '-'} {_hours(day['absence_hours']) if day['absence_hours'] else '-'}")
+
+
+def _single_day(store, employee_id, day, label):
+    days = list(store.iter_days(employee_id, day, day))
+    if not days:
+        return f"Chưa có dữ liệu chấm công của bạn ngày {day.strftime(DATE_FMT)}."
+    d = days[0]
+    return (f"Vâng, đây là dữ liệu chấm công của bạn {label}:\n\n"
+            f"        📅 **Ngày làm việc**: {d['date'].strftime(DATE_FMT)} ({_WEEKDAYS[d['date'].weekday()]})\n"
+            f"        ⏰ **Ca làm việc**: {d['shift'] or '-'}\n"
+            f"        🟢 **Giờ vào**: {d['check_in'] if d['check_in'] != '-' else 'Chưa có'}\n"
+            f"        🔴 **Giờ ra**: {d['check_out'] if d['check_out'] != '-' else 'Chưa có'}\n"
+            f"        ⏱️ **Giờ làm việc**: {_hours(d['worked_hours'])}\n"
+            f"        🌙 **Giờ tăng ca**: {_hours(d['overtime_hours'])}\n"
+            f"        ❌ **Giờ vắng**: {_hours(d['absence_hours']) if d['absence_hours'] else 'Không có'}\n"
+            f"        📋 **Loại vắng**: {d['absence_type'] or 'Không có'}")
+
+
+def reply_header(intent: str, start, end) -> str:
+    """Câu mở đầu của câu trả lời dạng bảng (dùng chung cho /predict và chế độ stream)."""
+    span = f"từ ngày {start.strftime(DATE_FMT)} đến {end.strftime(DATE_FMT)}"
+    if intent.startswith("NGAYCONG"):
+        return (f"Vâng, đây là dữ liệu chấm công của bạn {span}:\n\n    📊 **Bảng chấm công**\n"
+                "        Ngày làm việc Ca làm việc Giờ vào Giờ ra Giờ làm Giờ tăng ca Loại vắng Số giờ vắng")
+    if intent == "NGAYNGHI_YEAR":
+        return (f"Vâng, đây là dữ liệu ngày nghỉ của bạn trên hệ thống ghi nhận {span}:\n\n    📊 **Bảng ngày nghỉ**\n"
+                "        Ngày làm việc Ca làm việc Loại vắng Số giờ vắng")
+    return f"Vâng, đây là dữ liệu chi tiết về ngày nghỉ phép năm {span} của bạn:\n\n    📋 **Phép năm đã sử dụng:**"
+
+
+def _intent_days(store, intent: str, employee_id: str, start, end):
+    """Các ngày mà bảng của intent liệt kê: mọi ngày (chấm công), ngày vắng, ngày nghỉ phép năm."""
+    if intent.startswith("NGAYCONG"):
+        return store.iter_days(employee_id, start, end)
+    if intent == "NGAYNGHI_YEAR":
+        return store.iter_days(employee_id, start, end, absences_only=True)
+    return store.iter_days(employee_id, start, end, absence_type=ANNUAL_LEAVE)
+
+
+def reply_days(store, intent: str, employee_id: str, start, end):
+    """Các dòng của bảng, sinh dần theo ngày."""
+    for day in _intent_days(store, intent, employee_id, start, end):
+        if intent.startswith("NGAYCONG"):
+            yield "        " + _timesheet_line(day)
+        elif intent == "NGAYNGHI_YEAR":
+            yield (f"        {day['date'].strftime(DATE_FMT)} {day['shift']} "
+                   f"{day['absence_type']} {_hours(day['absence_hours'])}")
+        else:
+            yield f"        • 📅 {day['date'].strftime(DATE_FMT)} : {_hours(day['absence_hours'])} giờ"
+
+
+def reply_footer(intent: str, summary: dict) -> str:
+    if intent.startswith("NGAYCONG"):
+        return (f"\n    📊 **Tổng kết:** {summary['days_worked']} ngày công, "
+                f"{_hours(summary['worked_hours'])} giờ làm, {_hours(summary['overtime_hours'])} giờ tăng ca, "
+                f"vắng {_hours(summary['absence_hours'])} giờ ({summary['absence_days']} ngày)")
+    if intent == "NGAYNGHI_YEAR":
+        by_type = ", ".join(f"{name}: {_hours(hours)} giờ" for name, hours in summary["absence_by_type"].items())
+        return f"\n    📊 **Tổng kết:** {summary['absence_days']} ngày vắng" + (f" ({by_type})" if by_type else "")
+    leave = summary["annual_leave"]
+    return ("\n    📊 **Tổng kết:**\n"
+            f"        • ✅ Tổng đã nghỉ phép năm: {_hours(summary['absence_by_type'].get(ANNUAL_LEAVE, 0))} giờ\n"
+            f"        • 🎯 Phép năm còn lại ({leave['year']}): {_hours(leave['remaining_hours'] / 8)} ngày "
+            f"({_hours(leave['remaining_hours'])} giờ)")
+
+
+def attendance_summary(store, intent: str, employee_id: str, start, end) -> dict:
+    summary = store.summary(employee_id, start, end)
+    if intent.startswith("NGAYPHEPNAM"):
+        summary["annual_leave"] = store.leave_balance(employee_id, end.year)
+    return summary
+
+
+def attendance_reply(store, intent: str, employee_id: str, start, end):
+    """(message, summary) cho intent chấm công / nghỉ phép trong khoảng [start, end]."""
+    if employee_id not in store.employee_index:
+        return f"Không tìm thấy dữ liệu chấm công của nhân viên {employee_id}.", None
+    summary = attendance_summary(store, intent, employee_id, start, end)
+    if intent == "NGAYCONG_TODAY":
+        return _single_day(store, employee_id, start, "ngày hôm nay"), summary
+    if intent == "NGAYCONG_YESTERDAY":
+        return _single_day(store, employee_id, start, "ngày hôm qua"), summary
+    lines = [reply_header(intent, start, end), *reply_days(store, intent, employee_id, start, end),
+             reply_footer(intent, summary)]
+    return "\n".join(lines), summary
+
+
+def stream_reply(store, intent: str, employee_id: str, start, end, head: dict):
+    """
+    Câu trả lời dạng sự kiện để stream (NDJSON), không dựng cả bảng trong bộ nhớ
+    (chỉ cho STREAM_INTENTS):
+        {**head, "message": <câu mở đầu>}
+        {"row": {...}}          mỗi ngày trong bảng
+        {"summary": {...}, "message": <tổng kết>}
+    """
+    if employee_id not in store.employee_index:
+        yield dict(head, message=f"Không tìm thấy dữ liệu chấm công của nhân viên {employee_id}.")
+        return
+    yield dict(head, message=reply_header(intent, start, end))
+    for day in _intent_days(store, intent, employee_id, start, end):
+        yield {"row": dict(day, date=day["date"].isoformat())}
+    summary = attendance_summary(store, intent, employee_id, start, end)
+    yield {"summary": summary, "message": reply_footer(intent, summary).strip()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển file chấm công CSV sang dạng cột .npy (load bằng mmap)")
+    parser.add_argument('csv', help="file chấm công (xem docstring của module)")
+    parser.add_argument('--output', required=True, help="thư mục đích")
+    parser.add_argument('--balances', default=None, help="leave_balances.csv (mặc định cạnh file CSV)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    store = AttendanceStore.from_csv(args.csv, args.balances)
+    store.save(args.output)
+    print(f"✅ {len(store)} dòng, {len(store.employees)} nhân viên ({time.perf_counter() - t0:.1f}s) → {args.output}")
+
+
+if __name__ == '__main__':
+    main()
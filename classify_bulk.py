@@ -0,0 +1,260 @@
+"""
+Phân loại hàng loạt tin nhắn (mỗi dòng một câu) từ file hoặc stdin, không cần chạy API.
+
+- Đọc từng dòng, gom thành chunk, mỗi chunk 1 lần model.predict trong process pool
+  (mỗi worker load model một lần). Số chunk đang xử lý có giới hạn nên bộ nhớ không
+  tăng theo kích thước input; kết quả ghi ra dần theo đúng thứ tự input.
+- --with-time: thêm "time" + "message" như build_response_with_time (vi_time_parser,
+  khoảng mặc định của intent, Duckling nếu có --duckling-url).
+- Checkpoint <output>.ckpt sau mỗi chunk (offset trong file input + kích thước output):
+  chạy lại với --resume sẽ tiếp tục từ chunk cuối đã ghi xong.
+
+    python classify_bulk.py messages.txt --output out.jsonl --workers 8
+    cat messages.txt | python classify_bulk.py - --format csv --output out.csv
+    python classify_bulk.py a.txt b.txt --output out.jsonl --with-time --resume
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from model_utils import resolve_model_path
+
+CSV_FIELDS = ("source", "line", "text", "intent", "confidence",
+              "time_type", "time_date", "time_start", "time_end", "time_grain", "message")
+
+# ---------------------------------------------------------------- worker
+
+_worker = {}
+
+
+def _init_worker(model_path, with_time, duckling_url, templates_path):
+    import fasttext
+    from cache import LRUCache
+    _worker["model"] = fasttext.load_model(model_path)
+    _worker["with_time"] = with_time
+    if with_time:
+        from response_templates import TemplateRegistry
+        _worker["templates"] = TemplateRegistry.load(templates_path)
+        _worker["time_cache"] = LRUCache(10000)
+        _worker["duckling"] = None
+        if duckling_url:
+            from duckling_client import DucklingClient
+            _worker["duckling"] = DucklingClient(duckling_url, max_concurrency=1, pool_size=1)
+
+
+def _resolve_time(text, intent, now):
+    """Như api_prod: bỏ qua nếu không có dấu hiệu thời gian, fast path, cache, rồi Duckling."""
+    from time_utils import normalize_duckling_times
+    from vi_time_parser import has_time_hint, parse_time
+
+    if not has_time_hint(text):
+        return _worker["templates"].default_time_info(intent, now) or {"type": "none"}
+    fast = parse_time(text, now=now)
+    if fast is not None:
+        return fast
+    duckling = _worker["duckling"]
+    if duckling is None:
+        return {"type": "none"}
+    key = (text, now.date())
+    cached = _worker["time_cache"].get(key)
+    if cached is not None:
+        return cached
+    resp = duckling.parse(text, ref_time=now, default=None)
+    if resp is None:
+        return {"type": "none"}
+    time_info = normalize_duckling_times(resp)
+    _worker["time_cache"].set(key, time_info)
+    return time_info
+
+
+def classify_chunk(records):
+    """records: [(source, line_no, text)] → list dict kết quả cùng thứ tự."""
+    model = _worker["model"]
+    lines = [text.replace('\r', ' ') for _source, _line, text in records]
+    labels, probs = model.predict(lines, k=1)
+    now = None
+    if _worker["with_time"]:
+        from time_utils import TZ
+        now = datetime.now(TZ)
+
+    out = []
+    for (source, line_no, text), lbls, ps in zip(records, labels, probs):
+        intent = lbls[0].replace('__label__', '') if lbls else "UNKNOWN"
+        row = {"source": source, "line": line_no, "text": text,
+               "intent": intent, "confidence": round(float(ps[0]), 6) if lbls else 0.0}
+        if now is not None:
+            time_info = _resolve_time(text, intent, now) if "NGAY" in intent else {"type": "none"}
+            row["time"] = time_info
+            row["message"] = _worker["templates"].render(intent, time_info)
+        out.append(row)
+    return out
+
+
+# ---------------------------------------------------------------- input / output
+
+def read_chunks(sources, chunk_size, start_file=0, start_offset=0, start_line=0):
+    """
+    Sinh (records, file_index, offset_sau_chunk, line_no_sau_chunk). Đọc nhị phân để
+    offset là vị trí byte thật (seek được khi resume). Chunk không vượt qua ranh giới file.
+    """
+    for file_index in range(start_file, len(sources)):
+        source = sources[file_index]
+        resume = file_index == start_file
+        f = sys.stdin.buffer if source == '-' else open(source, 'rb')
+        try:
+            line_no = start_line if resume else 0
+            if resume and (start_offset or start_line):
+                if source == '-':
+                    raise SystemExit("Không resume được khi đọc từ stdin")
+                f.seek(start_offset)
+            records = []
+            while True:
+                raw = f.readline()
+                if not raw:
+                    break
+                line_no += 1
+                text = raw.decode('utf-8', errors='replace').strip()
+                if not text:
+                    continue
+                records.append((source, line_no, text))
+                if len(records) >= chunk_size:
+                    yield records, file_index, (f.tell() if source != '-' else 0), line_no
+                    records = []
+            if records:
+                yield records, file_index, (f.tell() if source != '-' else 0), line_no
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+
+
+class Writer:
+    def __init__(self, out, fmt):
+        self.out = out
+        self.fmt = fmt
+        self._csv = csv.DictWriter(out, CSV_FIELDS, extrasaction='ignore') if fmt == 'csv' else None
+
+    def write_header(self):
+        if self._csv is not None:
+            self._csv.writeheader()
+
+    def write(self, rows):
+        if self._csv is None:
+            self.out.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+            return
+        for row in rows:
+            time_info = row.pop("time", None) or {}
+            row.update({
+                "time_type": time_info.get("type", ""),
+                "time_date": time_info.get("date", ""),
+                "time_start": time_info.get("start", ""),
+                "time_end": time_info.get("end", ""),
+                "time_grain": time_info.get("grain", ""),
+            })
+            self._csv.writerow(row)
+
+
+def _load_checkpoint(path, sources):
+    with open(path, encoding='utf-8') as f:
+        ckpt = json.load(f)
+    if ckpt.get("sources") != sources:
+        raise SystemExit(f"Checkpoint {path} thuộc input khác: {ckpt.get('sources')}")
+    return ckpt
+
+
+def _save_checkpoint(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+# ---------------------------------------------------------------- main
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help="file input (mỗi dòng một câu), '-' = stdin")
+    parser.add_argument('--output', required=True, help="file kết quả (.jsonl hoặc .csv)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None, help="mặc định theo đuôi file output")
+    parser.add_argument('--model', default=None, help="file model (mặc định như API, xem model_utils.resolve_model_path)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=10000, help="số câu mỗi lần model.predict")
+    parser.add_argument('--with-time', action='store_true', help="thêm time + message như /predict")
+    parser.add_argument('--duckling-url', default=None, help="--with-time: gọi Duckling cho câu mà parser nội bộ không hiểu")
+    parser.add_argument('--templates', default='templates/responses.json')
+    parser.add_argument('--resume', action='store_true', help="tiếp tục từ checkpoint <output>.ckpt")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fmt = args.format or ('csv' if args.output.endswith('.csv') else 'jsonl')
+    ckpt_path = args.output + '.ckpt'
+    state = {"sources": args.inputs, "file_index": 0, "offset": 0, "line": 0, "records": 0, "output_bytes": 0}
+    if args.resume and os.path.exists(ckpt_path):
+        state = _load_checkpoint(ckpt_path, args.inputs)
+        print(f"↩️  Resuming at {state['sources'][state['file_index']]}:{state['line']} "
+              f"({state['records']} records done)", file=sys.stderr)
+
+    # Bỏ phần output ghi dở sau checkpoint cuối (crash giữa chừng). Output mất hoặc ngắn
+    # hơn checkpoint thì không resume được (truncate sẽ chèn byte 0 vào file)
+    if state["output_bytes"]:
+        size = os.path.getsize(args.output) if os.path.exists(args.output) else None
+        if size is None or size < state["output_bytes"]:
+            raise SystemExit(f"Checkpoint {ckpt_path} cần {state['output_bytes']} byte output nhưng "
+                             f"{args.output} {'không tồn tại' if size is None else f'chỉ có {size} byte'}; "
+                             f"xoá checkpoint để chạy lại từ đầu")
+    mode = 'r+b' if state["output_bytes"] else 'wb'
+    raw_out = open(args.output, mode)
+    raw_out.truncate(state["output_bytes"])
+    raw_out.seek(state["output_bytes"])
+    out = io.TextIOWrapper(raw_out, encoding='utf-8', newline='')
+    writer = Writer(out, fmt)
+    if state["output_bytes"] == 0:
+        writer.write_header()
+
+    model_path = resolve_model_path(args.model)
+    workers = max(1, args.workers)
+    max_pending = workers * 2  # số chunk tối đa đang xử lý / chờ ghi
+    t0 = time.perf_counter()
+    done = 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(model_path, args.with_time, args.duckling_url, args.templates),
+    ) as pool:
+        pending = deque()
+
+        def drain_one():
+            nonlocal done
+            future, file_index, offset, line_no = pending.popleft()
+            rows = future.result()
+            writer.write(rows)
+            out.flush()
+            done += len(rows)
+            state.update(file_index=file_index, offset=offset, line=line_no,
+                         records=state["records"] + len(rows), output_bytes=raw_out.tell())
+            _save_checkpoint(ckpt_path, state)
+
+        chunks = read_chunks(args.inputs, args.chunk_size, state["file_index"], state["offset"], state["line"])
+        for records, file_index, offset, line_no in chunks:
+            pending.append((pool.submit(classify_chunk, records), file_index, offset, line_no))
+            if len(pending) >= max_pending:
+                drain_one()
+        while pending:
+            drain_one()
+
+    out.close()
+    elapsed = time.perf_counter() - t0
+    rate = done / elapsed if elapsed else 0.0
+    print(f"✅ {done} records in {elapsed:.1f}s ({rate:.0f}/s) → {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Client gọi Duckling dùng chung cho api_prod.py / api.py / app.py.
+
+- Session keep-alive với connection pool (không mở TCP mới mỗi request).
+- Giới hạn số request đồng thời tới Duckling.
+- Timeout theo ngân sách (deadline) của từng lời gọi.
+- Circuit breaker: Duckling lỗi liên tục thì trả [] ngay, không chờ timeout.
+
+Khi process đã gevent monkey.patch_all() (api_prod.py), socket và semaphore
+ở đây đều cooperative nên không chặn các greenlet khác. AsyncDucklingClient là
+bản asyncio (httpx) cho api_async.py, cùng breaker và cùng số liệu thống kê.
+"""
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # chỉ AsyncDucklingClient (api_async.py) cần httpx
+    httpx = None
+
+_EMPTY = object()
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    closed    → gọi bình thường, đếm lỗi liên tiếp.
+    open      → từ chối ngay trong reset_timeout giây.
+    half_open → cho đúng 1 request thử; thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def cancel(self):
+        """Request được allow() nhưng không gửi đi → cho request sau thử lại."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class _DucklingClientBase:
+    def __init__(self, url, locale, timeout, connect_timeout, breaker):
+        self.url = url
+        self.locale = locale
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker or CircuitBreaker()
+
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.short_circuited = 0
+        self.saturated = 0
+
+    def _form_data(self, text, ref_time):
+        # Duckling yêu cầu body x-www-form-urlencoded, không phải JSON
+        return {
+            "locale": self.locale,
+            "text": text,
+            "dims": '["time"]',
+            "reftime": str(int(ref_time.timestamp() * 1000)),
+        }
+
+    def _remaining(self, deadline):
+        if deadline is None:
+            return self.timeout
+        return min(self.timeout, deadline - time.monotonic())
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "short_circuited": self.short_circuited,
+            "saturated": self.saturated,
+            "breaker_state": self.breaker.state,
+        }
+
+
+class DucklingClient(_DucklingClientBase):
+    def __init__(
+        self,
+        url: str,
+        locale: str = "vi_VN",
+        timeout: float = 1.5,
+        connect_timeout: float = 0.3,
+        pool_size: int = 20,
+        max_concurrency: int = 20,
+        breaker: CircuitBreaker = None,
+    ):
+        super().__init__(url, locale, timeout, connect_timeout, breaker)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Content-Type"] = "application/x-www-form-urlencoded; charset=UTF-8"
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def parse(self, text: str, ref_time: datetime, deadline: float = None, default=_EMPTY):
+        """
+        Parse thời gian trong text. Lỗi / bị từ chối thì trả về default
+        (mặc định list rỗng để normalize_duckling_times trả {"type": "none"}).
+
+        deadline: mốc time.monotonic() mà kết quả phải có trước đó.
+        default: giá trị trả về khi không có kết quả từ Duckling, VD None để
+                 phân biệt "lỗi" với "không có mốc thời gian".
+        """
+        if default is _EMPTY:
+            default = []
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            return default
+
+        budget = self._remaining(deadline)
+        if budget <= 0 or not self._slots.acquire(timeout=budget):
+            # Không được gọi thì không tính là lỗi của Duckling
+            self.saturated += 1
+            self.breaker.cancel()
+            return default
+
+        try:
+            budget = self._remaining(deadline)
+            if budget <= 0:
+                self.timeouts += 1
+                self.breaker.cancel()
+                return default
+            self.calls += 1
+            r = self.session.post(
+                self.url,
+                data=self._form_data(text, ref_time),
+                timeout=(min(self.connect_timeout, budget), budget),
+            )
+            r.raise_for_status()
+            result = r.json()
+        except requests.Timeout as e:
+            self.timeouts += 1
+            self.breaker.record_failure()
+            log.warning("duckling.timeout", extra={"fields": {"error": str(e)}})
+            return default
+        except Exception as e:
+            self.errors += 1
+            self.breaker.record_failure()
+            log.warning("duckling.error", extra={"fields": {"error": f"{type(e).__name__}: {e}"}})
+            return default
+        finally:
+            self._slots.release()
+
+        self.breaker.record_success()
+        return result
+
+
+class AsyncDucklingClient(_DucklingClientBase):
+    """
+    Bản asyncio của DucklingClient: httpx.AsyncClient giữ pool keep-alive,
+    asyncio.Semaphore giới hạn số lời gọi đồng thời. Gọi start() trong event loop
+    trước khi dùng, aclose() khi tắt server.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        locale: str = "vi_VN",
+        timeout: float = 1.5,
+        connect_timeout: float = 0.3,
+        pool_size: int = 20,
+        max_concurrency: int = 20,
+        breaker: CircuitBreaker = None,
+    ):
+        if httpx is None:
+            raise RuntimeError("AsyncDucklingClient cần thư viện httpx (pip install httpx)")
+        super().__init__(url, locale, timeout, connect_timeout, breaker)
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.client = None
+        self._slots = None
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            headers={"Content-Type": "application/x-www-form-urlencoded; charset=UTF-8"},
+        )
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def parse(self, text: str, ref_time: datetime, deadline: float = None, default=_EMPTY):
+        """Giống DucklingClient.parse."""
+        if default is _EMPTY:
+            default = []
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            return default
+
+        budget = self._remaining(deadline)
+        try:
+            if budget <= 0:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(self._slots.acquire(), budget)
+        except asyncio.TimeoutError:
+            self.saturated += 1
+            self.breaker.cancel()
+            return default
+        except asyncio.CancelledError:
+            # Huỷ khi đang chờ slot: trả lượt thử half_open cho request sau
+            self.breaker.cancel()
+            raise
+
+        try:
+            budget = self._remaining(deadline)
+            if budget <= 0:
+                self.timeouts += 1
+                self.breaker.cancel()
+                return default
+            self.calls += 1
+            r = await self.client.post(
+                self.url,
+                data=self._form_data(text, ref_time),
+                timeout=httpx.Timeout(budget, connect=min(self.connect_timeout, budget)),
+            )
+            r.raise_for_status()
+            result = r.json()
+        except httpx.TimeoutException as e:
+            self.timeouts += 1
+            self.breaker.record_failure()
+            log.warning("duckling.timeout", extra={"fields": {"error": str(e)}})
+            return default
+        except asyncio.CancelledError:
+            if deadline is not None and time.monotonic() >= deadline:
+                # Bị huỷ vì đã quá deadline: Duckling không trả lời kịp, tính như timeout
+                self.timeouts += 1
+                self.breaker.record_failure()
+                log.warning("duckling.timeout", extra={"fields": {"error": "cancelled at deadline"}})
+            else:
+                # Request bị huỷ trước deadline (client ngắt): không phải lỗi của Duckling
+                self.breaker.cancel()
+            raise
+        except Exception as e:
+            self.errors += 1
+            self.breaker.record_failure()
+            log.warning("duckling.error", extra={"fields": {"error": f"{type(e).__name__}: {e}"}})
+            return default
+        finally:
+            self._slots.release()
+
+        self.breaker.record_success()
+        return result
@@ -0,0 +1,139 @@
+"""
+Tầng tra cứu trước fastText: câu trùng (sau canonical_text) với một câu trong corpus
+huấn luyện, hoặc chứa một cụm từ khoá trong data/keyword_rules.txt, được trả lời
+ngay bằng label đã biết, không gọi model.predict.
+
+1. Khớp nguyên câu với corpus (dict). Câu mà corpus gán cho nhiều label: dùng label
+   của luật từ khoá khớp trong câu nếu có, không thì label xuất hiện nhiều nhất,
+   hoà thì label gặp trước (theo thứ tự file) → luôn cùng một kết quả.
+2. Luật từ khoá: trie theo từ, cụm phải là cả câu, hoặc cả câu sau một lời dẫn ngắn
+   trong RULE_PREFIXES ("cho tôi xem chấm công hôm qua"). Từ khác đứng trước ("không
+   phải chấm công hôm nay", "tôi quên chấm công hôm nay") hoặc theo sau ("chấm công
+   tháng trước trước") thì không tính, để model quyết định.
+3. Không khớp → None, caller dùng fastText.
+
+Chỉ dùng corpus mà model đang phục vụ được train (train.py TRAIN_FILE) và chỉ giữ
+label model có (labels=model.get_labels()): data/training_data2.txt dùng bộ label
+cũ (CHAM_CONG, XEM_LUONG, ...) không có trong model lẫn templates.
+"""
+import os
+from collections import Counter, defaultdict
+
+from text_norm import canonical_text
+
+DEFAULT_CORPORA = ('data/training_data.txt',)
+DEFAULT_RULES = 'data/keyword_rules.txt'
+
+_LABEL = "\0"  # key đánh dấu nút cuối cụm từ trong trie
+
+# Lời dẫn được phép đứng trước cụm từ khoá (đã chuẩn hoá như canonical_text)
+RULE_PREFIXES = (
+    "xem", "cho xem", "cho tôi xem", "cho mình xem", "tôi muốn xem", "mình muốn xem",
+    "kiểm tra", "tra cứu", "cho tôi biết", "cho mình biết", "tôi muốn biết",
+)
+
+
+def _read_labelled(path):
+    """(label, câu đã chuẩn hoá) từ file định dạng __label__X câu."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith('__label__'):
+                continue
+            label, _, text = line.partition(' ')
+            text = canonical_text(text)
+            if text:
+                yield label.replace('__label__', ''), text
+
+
+class KeywordIndex:
+    def __init__(self):
+        self.exact = {}   # câu đã chuẩn hoá -> label
+        self.trie = {}    # từ -> nút con; nút cuối cụm có key _LABEL
+        self.prefixes = {tuple(canonical_text(p).split(" ")) for p in RULE_PREFIXES}
+        self.rules = 0
+        self.ambiguous = 0
+
+        self.exact_hits = 0
+        self.keyword_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def build(cls, corpus_paths=DEFAULT_CORPORA, rules_path=DEFAULT_RULES, labels=None):
+        """labels: label model biết (có hoặc không có tiền tố __label__); None = giữ hết."""
+        if labels is not None:
+            labels = {label.replace('__label__', '') for label in labels}
+        index = cls()
+        if rules_path and os.path.exists(rules_path):
+            for label, phrase in _read_labelled(rules_path):
+                if labels is None or label in labels:
+                    index.add_rule(phrase, label)
+
+        counts = defaultdict(Counter)
+        order = {}
+        for path in corpus_paths:
+            for label, text in _read_labelled(path):
+                if labels is not None and label not in labels:
+                    continue
+                counts[text][label] += 1
+                order.setdefault((text, label), len(order))
+        for text, seen in counts.items():
+            if len(seen) > 1:
+                index.ambiguous += 1
+                ruled = index._match_keyword(text.split(" "))
+                if ruled in seen:
+                    index.exact[text] = ruled
+                    continue
+            best = max(seen.values())
+            index.exact[text] = min(
+                (label for label, n in seen.items() if n == best),
+                key=lambda label: order[(text, label)],
+            )
+        return index
+
+    def add_rule(self, phrase: str, label: str):
+        node = self.trie
+        for token in canonical_text(phrase).split(" "):
+            node = node.setdefault(token, {})
+        node[_LABEL] = label
+        self.rules += 1
+
+    def _match_keyword(self, tokens):
+        """Label của cụm chiếm cả câu, hoặc cả phần sau một lời dẫn trong RULE_PREFIXES."""
+        for start in range(len(tokens)):
+            if start and tuple(tokens[:start]) not in self.prefixes:
+                continue
+            node = self.trie
+            for i in range(start, len(tokens)):
+                node = node.get(tokens[i])
+                if node is None:
+                    break
+            else:
+                label = node.get(_LABEL)
+                if label is not None:
+                    return label  # start nhỏ nhất = cụm dài nhất
+        return None
+
+    def lookup(self, key: str):
+        """key: câu đã qua canonical_text. Trả về label hoặc None."""
+        label = self.exact.get(key)
+        if label is not None:
+            self.exact_hits += 1
+            return label
+        if self.trie:
+            label = self._match_keyword(key.split(" "))
+            if label is not None:
+                self.keyword_hits += 1
+                return label
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {
+            "exact_entries": len(self.exact),
+            "ambiguous_entries": self.ambiguous,
+            "rules": self.rules,
+            "exact_hits": self.exact_hits,
+            "keyword_hits": self.keyword_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,356 @@
+"""
+Load test cho /predict: phát lại các câu trong corpus huấn luyện theo tỉ lệ traffic
+cấu hình được, ở mức concurrency cố định hoặc RPS mục tiêu, rồi báo cáo JSON
+(throughput, p50/p95/p99/max, tỉ lệ lỗi, chi tiết theo intent).
+
+Chạy offline: --stub-duckling bật một Duckling giả trong process (độ trễ cấu hình
+được); --server-cmd khởi động server cần đo với DUCKLING_URL trỏ vào Duckling giả.
+
+    # server đang chạy sẵn
+    python loadtest.py --url http://localhost:5000/predict --concurrency 64 --duration 30
+
+    # tự khởi động server + Duckling giả, so sánh các chế độ
+    python loadtest.py --stub-duckling 8090 --server-cmd "python api_prod.py" --rps 500
+    WORKERS=4 python loadtest.py --stub-duckling 8090 --server-cmd "python api_prod.py" --rps 500
+    python loadtest.py --stub-duckling 8090 --server-cmd "python api_async.py" --rps 500
+
+    # 70% câu hỏi chấm công theo khoảng, 30% chào hỏi
+    python loadtest.py --mix NGAYCONG_FROMTO=7,WELCOME=3
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shlex
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_CORPORA = ('data/training_data.txt', 'data/training_data2.txt')
+
+
+# ---------------------------------------------------------------- corpus
+
+def load_corpus(paths):
+    """[(label, text)] từ các file fastText (__label__X câu)."""
+    items = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('__label__'):
+                    label, _, text = line.partition(' ')
+                    items.append((label.replace('__label__', ''), text))
+    return items
+
+
+def parse_mix(spec):
+    """"NGAYCONG_FROMTO=7,WELCOME=3" → {"NGAYCONG_FROMTO": 7.0, "WELCOME": 3.0}"""
+    mix = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        label, _, weight = part.partition('=')
+        mix[label] = float(weight or 1)
+    return mix
+
+
+def build_sampler(items, mix, seed):
+    """Hàm trả về (label, text) ngẫu nhiên: mix rỗng = theo phân bố corpus."""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    if not mix:
+        def sample():
+            with lock:
+                return rng.choice(items)
+        return sample
+
+    by_label = defaultdict(list)
+    for label, text in items:
+        by_label[label].append((label, text))
+    missing = [label for label in mix if label not in by_label]
+    if missing:
+        raise SystemExit(f"Không có câu nào cho label: {', '.join(missing)}")
+    labels = list(mix)
+    weights = [mix[label] for label in labels]
+
+    def sample():
+        with lock:
+            label = rng.choices(labels, weights)[0]
+            return rng.choice(by_label[label])
+    return sample
+
+
+# ---------------------------------------------------------------- Duckling giả
+
+_DIGIT_RE = re.compile(r"\d")
+
+
+class _StubDucklingHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    protocol_version = "HTTP/1.1"
+    # Header + body đi chung 1 lần ghi, tắt Nagle: tránh trễ ~40 ms do delayed ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        text = form.get('text', [''])[0]
+        reftime = int(form.get('reftime', ['0'])[0] or 0)
+        if self.latency:
+            time.sleep(self.latency)
+        result = []
+        if _DIGIT_RE.search(text):
+            # Đủ để normalize_duckling_times trả về 1 ngày
+            day = datetime.fromtimestamp(reftime / 1000, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            value = {"type": "value", "value": day.isoformat(), "grain": "day"}
+            result = [{"dim": "time", "body": text, "value": dict(value, values=[value])}]
+        body = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass
+
+
+def start_stub_duckling(port, latency_ms):
+    handler = type('StubDuckling', (_StubDucklingHandler,), {"latency": latency_ms / 1000.0})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🦆 Stub Duckling on :{port} (latency {latency_ms} ms)")
+    return server
+
+
+# ---------------------------------------------------------------- server cần đo
+
+def start_server(cmd, url, duckling_port, ready_timeout):
+    env = dict(os.environ)
+    if duckling_port:
+        env["DUCKLING_URL"] = f"http://127.0.0.1:{duckling_port}/parse"
+    env.setdefault("PORT", str(urlparse(url).port or 80))
+    proc = subprocess.Popen(shlex.split(cmd), env=env)
+    stats_url = urlparse(url)._replace(path='/stats').geturl()
+    deadline = time.monotonic() + ready_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"Server thoát sớm (exit {proc.returncode})")
+        try:
+            status, _body = _request(_connect(urlparse(stats_url)), 'GET', '/stats', None, 2.0)
+            if status == 200:
+                print(f"🚀 Server ready: {cmd}")
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise SystemExit(f"Server không sẵn sàng sau {ready_timeout}s")
+
+
+# ---------------------------------------------------------------- load
+
+def _connect(parsed, timeout=10.0):
+    cls = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+    return cls(parsed.hostname, parsed.port, timeout=timeout)
+
+
+def _request(conn, method, path, body, timeout):
+    conn.timeout = timeout
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    conn.request(method, path, body=body, headers=headers)
+    resp = conn.getresponse()
+    return resp.status, resp.read()
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.per_intent = defaultdict(lambda: {"requests": 0, "latencies": [], "errors": 0, "mismatches": 0})
+
+    def add(self, label, latency, status, predicted=None, error=None):
+        with self.lock:
+            entry = self.per_intent[label]
+            entry["requests"] += 1
+            if error is not None:
+                self.errors[error] += 1
+                entry["errors"] += 1
+                return
+            self.statuses[status] += 1
+            self.latencies.append(latency)
+            entry["latencies"].append(latency)
+            if status != 200:
+                entry["errors"] += 1
+            elif predicted != label:
+                entry["mismatches"] += 1
+
+
+def _worker(url, sample, recorder, stop_at, schedule, timeout):
+    parsed = urlparse(url)
+    path = parsed.path or '/'
+    conn = _connect(parsed, timeout)
+    while True:
+        scheduled = schedule()
+        if scheduled is None or scheduled >= stop_at:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        label, text = sample()
+        body = json.dumps({"text": text}).encode()
+        try:
+            status, raw = _request(conn, 'POST', path, body, timeout)
+        except (OSError, http.client.HTTPException) as e:
+            # Độ trễ tính từ thời điểm lẽ ra phải gửi (open loop) → không giấu hàng đợi phía client
+            recorder.add(label, time.perf_counter() - scheduled, None, error=type(e).__name__)
+            conn.close()
+            conn = _connect(parsed, timeout)
+            continue
+        latency = time.perf_counter() - scheduled
+        predicted = None
+        if status == 200:
+            try:
+                predicted = json.loads(raw).get('intent')
+            except ValueError:
+                status = 'bad_json'
+        recorder.add(label, latency, status, predicted)
+    conn.close()
+
+
+def _make_schedule(rps, start):
+    """Closed loop (rps=None): gửi ngay khi xong request trước. Open loop: mốc gửi thứ n = start + n/rps."""
+    counter = [0]
+    lock = threading.Lock()
+
+    def schedule():
+        if rps is None:
+            return time.perf_counter()
+        with lock:
+            n = counter[0]
+            counter[0] += 1
+        return start + n / rps
+    return schedule
+
+
+def run_load(url, sample, concurrency, duration, rps=None, timeout=10.0):
+    recorder = Recorder()
+    start = time.perf_counter()
+    stop_at = start + duration
+    schedule = _make_schedule(rps, start)
+    threads = [
+        threading.Thread(target=_worker, args=(url, sample, recorder, stop_at, schedule, timeout), daemon=True)
+        for _ in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder, time.perf_counter() - start
+
+
+# ---------------------------------------------------------------- report
+
+def percentiles(values):
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    values = sorted(values)
+
+    def pct(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+    return {"p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99), "max_ms": round(values[-1] * 1000, 2)}
+
+
+def build_report(recorder, elapsed, config):
+    ok = recorder.statuses.get(200, 0)
+    total = sum(recorder.statuses.values()) + sum(recorder.errors.values())
+    failed = total - ok
+    per_intent = {}
+    for label, entry in sorted(recorder.per_intent.items()):
+        answered = entry["requests"] - entry["errors"]
+        per_intent[label] = dict(
+            percentiles(entry["latencies"]),
+            requests=entry["requests"],
+            errors=entry["errors"],
+            # Tỉ lệ câu trả lời 200 có intent khác label trong corpus
+            mismatch_rate=round(entry["mismatches"] / answered, 4) if answered else None,
+        )
+    return {
+        "config": config,
+        "duration_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(ok / elapsed, 1) if elapsed else 0.0,
+        "error_rate": round(failed / total, 4) if total else 0.0,
+        "latency": percentiles(recorder.latencies),
+        "status_codes": {str(k): v for k, v in sorted(recorder.statuses.items(), key=lambda kv: str(kv[0]))},
+        "transport_errors": dict(recorder.errors),
+        "per_intent": per_intent,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000/predict')
+    parser.add_argument('--corpus', nargs='+', default=list(DEFAULT_CORPORA))
+    parser.add_argument('--mix', default='', help="tỉ lệ traffic theo label, VD NGAYCONG_FROMTO=7,WELCOME=3")
+    parser.add_argument('--concurrency', type=int, default=32, help="số kết nối / request đồng thời tối đa")
+    parser.add_argument('--rps', type=float, default=None, help="RPS mục tiêu (open loop); bỏ trống = closed loop")
+    parser.add_argument('--duration', type=float, default=30.0, help="thời gian đo (giây)")
+    parser.add_argument('--warmup', type=float, default=3.0, help="chạy trước khi đo (giây), không tính vào kết quả")
+    parser.add_argument('--timeout', type=float, default=10.0, help="timeout mỗi request (giây)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--stub-duckling', type=int, default=None, metavar='PORT', help="bật Duckling giả ở cổng này")
+    parser.add_argument('--duckling-latency-ms', type=float, default=20.0, help="độ trễ của Duckling giả")
+    parser.add_argument('--server-cmd', default=None, help="lệnh khởi động server cần đo, VD \"python api_prod.py\"")
+    parser.add_argument('--ready-timeout', type=float, default=60.0)
+    parser.add_argument('--output', default='loadtest_report.json')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    items = load_corpus(args.corpus)
+    sample = build_sampler(items, parse_mix(args.mix), args.seed)
+
+    stub = start_stub_duckling(args.stub_duckling, args.duckling_latency_ms) if args.stub_duckling else None
+    server = start_server(args.server_cmd, args.url, args.stub_duckling, args.ready_timeout) if args.server_cmd else None
+    try:
+        if args.warmup > 0:
+            run_load(args.url, sample, args.concurrency, args.warmup, args.rps, args.timeout)
+        mode = f"{args.rps} rps" if args.rps else f"concurrency {args.concurrency}"
+        print(f"⏳ Measuring {args.url} for {args.duration}s ({mode})...")
+        recorder, elapsed = run_load(args.url, sample, args.concurrency, args.duration, args.rps, args.timeout)
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if stub is not None:
+            stub.shutdown()
+
+    config = {k: v for k, v in vars(args).items() if k != 'output'}
+    report = build_report(recorder, elapsed, config)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    lat = report["latency"]
+    print(f"\nrequests={report['requests']} throughput={report['throughput_rps']} rps "
+          f"error_rate={report['error_rate']:.2%}")
+    print(f"p50={lat['p50_ms']}ms p95={lat['p95_ms']}ms p99={lat['p99_ms']}ms max={lat['max_ms']}ms")
+    print(f"✅ Report saved: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Logging có cấu trúc (mỗi dòng một JSON) cho các server, thay cho print().
+
+- Ghi log không chặn: record được đưa vào hàng đợi, một thread hệ điều hành thật
+  (kể cả khi đã gevent monkey.patch_all()) lấy ra và ghi stdout. Hàng đợi đầy thì
+  bỏ record và đếm lại, không để request phải chờ I/O.
+- Mức log theo LOG_LEVEL (mặc định INFO); log.debug(...) khi debug tắt chỉ tốn
+  một lần kiểm tra level.
+- Lấy mẫu theo tên sự kiện cho các dòng nhiều: LOG_SAMPLE="duckling.response=0.01"
+  (giữ ~1% số dòng "duckling.response").
+- request_id gắn vào mọi dòng log trong cùng request (contextvars: riêng cho từng
+  greenlet / asyncio task).
+
+    log = logging.getLogger(__name__)
+    log.debug("duckling.response", extra={"fields": {"text": text, "resp": resp}})
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+MAX_QUEUE = 10000  # số record tối đa đang chờ ghi
+
+
+def _native(module, name):
+    """Bản gốc (chưa bị gevent patch) của module.name: thread/queue thật."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched(module):
+        return monkey.get_original(module, name)
+    return getattr(__import__(module), name)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Gắn request_id của request hiện tại vào record."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Chỉ giữ một tỉ lệ record theo tên sự kiện (record.msg), VD {"duckling.response": 0.01}."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self.dropped = 0
+
+    def filter(self, record):
+        rate = self.rates.get(record.msg)
+        if rate is None or rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class BackgroundHandler(logging.Handler):
+    """
+    Đưa record vào hàng đợi; thread nền gọi target.handle(). Sau fork (worker
+    pre-fork) thread nền không còn nên được tạo lại trong process con.
+    """
+
+    def __init__(self, target: logging.Handler, max_queue: int = MAX_QUEUE):
+        super().__init__()
+        self.target = target
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._start()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._start)
+        atexit.register(self.flush)
+
+    def _start(self):
+        self._queue = _native("queue", "SimpleQueue")()
+        _native("_thread", "start_new_thread")(self._run, ())
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            record = queue.get()
+            try:
+                self.target.handle(record)
+            except Exception:
+                self.target.handleError(record)
+
+    def emit(self, record):
+        if self._queue.qsize() >= self.max_queue:
+            self.dropped += 1
+            return
+        # Format message ngay (args có thể thay đổi sau khi request xong)
+        record.msg = record.getMessage()
+        record.args = None
+        self._queue.put(record)
+
+    def flush(self):
+        """Ghi nốt các record còn trong hàng đợi (lúc thoát process)."""
+        queue = self._queue
+        while not queue.empty():
+            try:
+                record = queue.get_nowait()
+            except Exception:
+                break
+            self.target.handle(record)
+        self.target.flush()
+
+
+def _parse_sampling(spec: str) -> dict:
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, rate = part.rpartition("=")
+        rates[name] = float(rate)
+    return rates
+
+
+_handler = None
+
+
+def setup_logging(level: str = None, sampling: str = None, stream=None) -> BackgroundHandler:
+    """Cấu hình root logger một lần cho process. Đọc LOG_LEVEL / LOG_SAMPLE nếu không truyền."""
+    global _handler
+    if _handler is not None:
+        return _handler
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    sampling = sampling if sampling is not None else os.environ.get("LOG_SAMPLE", "")
+
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonFormatter())
+    # target chỉ được dùng trong thread nền: cần lock thật, không phải lock của gevent
+    target.lock = _native("threading", "RLock")()
+    _handler = BackgroundHandler(target)
+    _handler.addFilter(SamplingFilter(_parse_sampling(sampling)))
+    _handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(level)
+    return _handler
+
+
+def stats():
+    if _handler is None:
+        return None
+    sampled_out = sum(getattr(f, "dropped", 0) for f in _handler.filters if isinstance(f, SamplingFilter))
+    return {"queued": _handler._queue.qsize(), "dropped": _handler.dropped, "sampled_out": sampled_out}
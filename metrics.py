@@ -0,0 +1,158 @@
+"""
+Metrics dạng Prometheus (text format 0.0.4), không phụ thuộc thư viện ngoài.
+
+Ghi nhận trên hot path chỉ là vài phép cộng vào dict/list (không lock: gevent chạy
+một thread, += trên số nguyên đủ an toàn cho mục đích thống kê). Counter/gauge lấy
+từ số liệu có sẵn (duckling.stats(), cache.stats(), ...) dùng CallbackMetric và
+chỉ được tính lúc /metrics được scrape.
+
+    REQUESTS = registry.counter("app_requests_total", "Số request", ("endpoint",))
+    REQUESTS.inc("predict")
+    with STAGE_SECONDS.time("fasttext"):
+        ...
+    registry.render()  # nội dung cho /metrics
+
+const_labels: nhãn gắn vào mọi series, tính lúc render (VD worker="<số thứ tự>" khi
+chạy nhiều worker pre-fork, mỗi worker một cổng /metrics; cộng lại bằng
+sum without (worker)).
+"""
+import bisect
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Mốc histogram độ trễ (giây): từ 0.1 ms (predict, template) tới 2.5 s (Duckling timeout)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, *extra) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(e for e in extra if e)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self, const=""):
+        for values, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, values, const)} {_fmt(value)}"
+
+
+class _Timer:
+    __slots__ = ("hist", "labelvalues", "start")
+
+    def __init__(self, hist, labelvalues):
+        self.hist = hist
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labelvalues -> [counts theo bucket (+Inf cuối), sum]
+
+    def observe(self, value: float, *labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *labelvalues):
+        """with hist.time("stage"): ... → ghi thời gian chạy của khối lệnh (giây)."""
+        return _Timer(self, labelvalues)
+
+    def collect(self, const=""):
+        for values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_fmt(float(bound))}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, const, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values, const)} {_fmt(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, values, const)} {cumulative}"
+
+
+class CallbackMetric:
+    """Giá trị đọc lúc scrape: fn() trả về số, hoặc iterable (labelvalues, số)."""
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge", labelnames=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+
+    def collect(self, const=""):
+        result = self.fn()
+        if not self.labelnames:
+            yield f"{self.name}{_labels((), (), const)} {_fmt(result)}"
+            return
+        for values, value in result:
+            yield f"{self.name}{_labels(self.labelnames, values, const)} {_fmt(value)}"
+
+
+class Registry:
+    def __init__(self, const_labels=None):
+        """const_labels: None hoặc hàm không tham số trả về dict nhãn → giá trị."""
+        self._metrics = []
+        self.const_labels = const_labels
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, kind="gauge", labelnames=()):
+        return self.register(CallbackMetric(name, help, fn, kind, labelnames))
+
+    def render(self) -> str:
+        const = ""
+        if self.const_labels is not None:
+            const = ",".join(f'{n}="{_escape(v)}"' for n, v in self.const_labels().items())
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect(const))
+        return "\n".join(lines) + "\n"
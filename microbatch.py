@@ -0,0 +1,116 @@
+"""
+Gom các lời gọi predict đồng thời (mỗi greenlet một request) thành 1 batch
+rồi gọi model.predict một lần.
+
+Chỉ dùng khi chạy dưới gevent (WSGIServer trong api_prod.py).
+"""
+import time
+
+import gevent
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Empty, Full
+
+# Mốc histogram kích thước batch
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class MicroBatcher:
+    def __init__(self, predict_batch, max_batch_size=32, max_wait_ms=2.0, max_queue=1024):
+        """
+        predict_batch: hàm nhận list[str], trả về list[(intent, confidence)] cùng thứ tự.
+        max_batch_size: số câu tối đa mỗi batch.
+        max_wait_ms: thời gian tối đa chờ gom thêm câu sau câu đầu tiên.
+        max_queue: số câu tối đa đang chờ; vượt quá thì submit() trả về None.
+        """
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = Queue(maxsize=max_queue)
+        self._worker = None
+
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.max_batch_seen = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.batch_size_hist = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+    def submit(self, text: str):
+        """
+        Đưa 1 câu vào hàng đợi và chờ kết quả (intent, confidence).
+        Trả về None nếu hàng đợi đầy để caller tự predict trực tiếp.
+        """
+        if self._worker is None or self._worker.dead:
+            # Spawn lười để greenlet được tạo trong đúng process (sau fork)
+            self._worker = gevent.spawn(self._run)
+        result = AsyncResult()
+        try:
+            self._queue.put_nowait((text, result, time.perf_counter()))
+        except Full:
+            self.rejected += 1
+            return None
+        return result.get()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            dispatched_at = time.perf_counter()
+            texts = [text for text, _result, _enqueued in batch]
+            try:
+                predictions = self.predict_batch(texts)
+            except Exception as e:
+                for _text, result, _enqueued in batch:
+                    result.set_exception(e)
+                continue
+            for (_text, result, _enqueued), pred in zip(batch, predictions):
+                result.set(pred)
+            self._record(batch, dispatched_at)
+
+    def _record(self, batch, dispatched_at):
+        size = len(batch)
+        self.batches += 1
+        self.items += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        for i, bound in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= bound:
+                self.batch_size_hist[i] += 1
+                break
+        else:
+            self.batch_size_hist[-1] += 1
+        for _text, _result, enqueued in batch:
+            waited = dispatched_at - enqueued
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+
+    def stats(self):
+        labels = [f"<={b}" for b in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self._queue.qsize(),
+            "queue_limit": self._queue.maxsize,
+            "batches": self.batches,
+            "items": self.items,
+            "rejected": self.rejected,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_seen": self.max_batch_seen,
+            "avg_wait_ms": self.wait_total / self.items * 1000 if self.items else 0.0,
+            "max_wait_seen_ms": self.wait_max * 1000,
+            "batch_size_hist": dict(zip(labels, self.batch_size_hist)),
+        }
@@ -0,0 +1,167 @@
+"""
+Quản lý model đang phục vụ: load bản mới ở nền, kiểm tra trên smoke set rồi
+đổi con trỏ một cách nguyên tử. Request đang chạy giữ snapshot (model, version)
+của riêng nó nên vẫn hoàn tất trên model cũ; khi request cuối cùng xong, model
+cũ không còn tham chiếu và được giải phóng.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import namedtuple
+from datetime import datetime
+
+import fasttext
+
+log = logging.getLogger(__name__)
+
+ModelSnapshot = namedtuple("ModelSnapshot", ["model", "version", "path", "loaded_at"])
+
+
+class ModelValidationError(Exception):
+    pass
+
+
+def model_version(path: str) -> str:
+    """VD: intent_model.bin@20251020-153000-1a2b3c4d (mtime + sha1 nội dung)."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    mtime = datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y%m%d-%H%M%S')
+    return f"{os.path.basename(path)}@{mtime}-{h.hexdigest()[:8]}"
+
+
+def load_smoke_set(path: str, per_label: int = 3):
+    """Lấy vài câu đầu tiên của mỗi label trong file huấn luyện làm smoke set."""
+    counts = {}
+    smoke = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith('__label__'):
+                continue
+            label, _, text = line.partition(' ')
+            if counts.get(label, 0) < per_label:
+                counts[label] = counts.get(label, 0) + 1
+                smoke.append((text, label.replace('__label__', '')))
+    return smoke
+
+
+class ModelManager:
+    def __init__(self, path: str, smoke_set=None, min_smoke_accuracy: float = 0.8,
+                 loader=fasttext.load_model, run_blocking=None):
+        """
+        smoke_set: list[(text, label)] dùng để kiểm tra model mới trước khi đổi.
+        run_blocking: hàm chạy tác vụ native nặng (load model) ngoài luồng chính,
+                      VD gevent threadpool.apply; None = gọi trực tiếp.
+        """
+        self.path = path
+        self.smoke_set = smoke_set or []
+        self.min_smoke_accuracy = min_smoke_accuracy
+        self.loader = loader
+        self.run_blocking = run_blocking or (lambda fn, args=(): fn(*args))
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._watched_mtime = None
+        self._retired = []  # weakref tới các model đã thay, để theo dõi đã giải phóng chưa
+
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_error = None
+
+        model = self.loader(path)
+        self._current = ModelSnapshot(model, model_version(path), path, time.time())
+        self._watched_mtime = os.path.getmtime(path)
+
+    @property
+    def current(self) -> ModelSnapshot:
+        return self._current
+
+    def _validate(self, model):
+        if not self.smoke_set:
+            return
+        correct = 0
+        for text, label in self.smoke_set:
+            labels, _probs = model.predict(text, k=1)
+            if labels and labels[0].replace('__label__', '') == label:
+                correct += 1
+        accuracy = correct / len(self.smoke_set)
+        if accuracy < self.min_smoke_accuracy:
+            raise ModelValidationError(
+                f"smoke accuracy {accuracy:.1%} < {self.min_smoke_accuracy:.0%}"
+            )
+
+    def reload(self, path: str = None) -> str:
+        """Load + validate model mới rồi đổi; lỗi thì giữ nguyên model đang chạy."""
+        path = path or self.path
+        with self._reload_lock:
+            try:
+                mtime = os.path.getmtime(path)
+                version = self.run_blocking(model_version, (path,))
+                if version == self._current.version:
+                    return version
+                model = self.run_blocking(self.loader, (path,))
+                self._validate(model)
+            except Exception as e:
+                self.failed_reloads += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+
+            old = self._current
+            self._current = ModelSnapshot(model, version, path, time.time())
+            self.path = path
+            self._watched_mtime = mtime
+            self.reloads += 1
+            self.last_error = None
+            self._retired.append(weakref.ref(old.model))
+            log.info("model.reloaded", extra={"fields": {"old_version": old.version, "version": version}})
+            return version
+
+    def watch(self, interval: float = 5.0):
+        """Theo dõi mtime file model, đổi model khi file thay đổi."""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._watcher = threading.Thread(target=self._watch_loop, args=(interval,), daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self, interval):
+        pending = None  # (mtime, size) lần kiểm tra trước của file đã đổi
+        while True:
+            time.sleep(interval)
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                continue
+            mtime = st.st_mtime
+            if mtime == self._watched_mtime:
+                pending = None
+                continue
+            # File bị ghi đè tại chỗ (không qua os.replace): chờ mtime/size đứng yên một
+            # chu kỳ rồi mới load, tránh đọc file đang ghi dở
+            if pending != (mtime, st.st_size):
+                pending = (mtime, st.st_size)
+                continue
+            pending = None
+            try:
+                self.reload()
+            except Exception as e:
+                # Không thử lại file lỗi cho tới khi nó đổi tiếp
+                self._watched_mtime = mtime
+                log.error("model.reload_failed", extra={"fields": {"path": self.path, "error": str(e)}})
+
+    def stats(self):
+        self._retired = [ref for ref in self._retired if ref() is not None]
+        snap = self._current
+        return {
+            "version": snap.version,
+            "path": snap.path,
+            "loaded_at": datetime.fromtimestamp(snap.loaded_at).isoformat(),
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "last_error": self.last_error,
+            # Model cũ còn được request đang chạy giữ (chưa giải phóng)
+            "retired_in_memory": len(self._retired),
+        }
@@ -0,0 +1,34 @@
+"""
+Chọn file model để phục vụ: .bin (đầy đủ) hoặc .ftz (đã quantize bằng train.py --quantize).
+fasttext.load_model đọc được cả hai định dạng.
+"""
+import os
+
+import fasttext
+
+DEFAULT_MODEL_PATH = 'models/intent_model.bin'
+
+
+def quantized_path(bin_path: str) -> str:
+    return os.path.splitext(bin_path)[0] + '.ftz'
+
+
+def resolve_model_path(path: str = None) -> str:
+    """
+    - MODEL_PATH (tham số hoặc biến môi trường) trỏ thẳng tới .bin/.ftz → dùng đúng file đó.
+    - Mặc định: dùng models/intent_model.ftz nếu có và không cũ hơn .bin, ngược lại dùng .bin.
+    """
+    path = path or os.environ.get("MODEL_PATH")
+    if path:
+        return path
+    ftz = quantized_path(DEFAULT_MODEL_PATH)
+    if os.path.exists(ftz):
+        if not os.path.exists(DEFAULT_MODEL_PATH) or os.path.getmtime(ftz) >= os.path.getmtime(DEFAULT_MODEL_PATH):
+            return ftz
+    return DEFAULT_MODEL_PATH
+
+
+def load_intent_model(path: str = None):
+    path = resolve_model_path(path)
+    print(f"📦 Loading model: {path}")
+    return fasttext.load_model(path)
@@ -0,0 +1,323 @@
+"""
+Chỉ mục láng giềng gần nhất trên sentence vector của fastText, dùng khi model
+không chắc chắn (confidence thấp):
+- "Có phải bạn muốn hỏi ...?": các câu huấn luyện gần nhất với câu người dùng.
+- Label dự phòng: bỏ phiếu kNN (có trọng số theo cosine) trên các câu đó.
+
+Vector của mọi câu huấn luyện (model.get_sentence_vector) được chuẩn hoá L2 và xếp
+thành một ma trận float32 C-contiguous (N, dim), lưu cạnh file model:
+
+    models/intent_model.bin.nn.npy   ma trận vector
+    models/intent_model.bin.nn.json  model_version, câu, label
+
+Lúc chạy ma trận được np.load(mmap_mode='r'): các worker pre-fork dùng chung page
+cache thay vì mỗi process một bản. Tìm kiếm là một phép nhân ma trận (BLAS) cho cả
+lô câu hỏi + argpartition lấy top-k, không cần thư viện ANN.
+
+Corpus lớn (>= IVF_MIN_SIZE câu) quét hết ma trận mỗi câu hỏi thì chậm (đọc N x dim
+float từ RAM): khi build, các câu được chia thành ~sqrt(N) cụm bằng k-means trên mặt
+cầu và xếp lại để mỗi cụm là một đoạn liền của ma trận (centroid lưu ở .nn.centroids.npy).
+Lúc tìm chỉ quét nprobe cụm có centroid gần câu hỏi nhất (gần đúng, đủ cho gợi ý).
+
+    python nn_index.py --model models/intent_model.bin   # build lại index cho model
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from text_norm import canonical_text
+
+# Corpus mà model được train (train.py TRAIN_FILE); câu có label model không biết bị bỏ
+# (data/training_data2.txt dùng bộ label cũ)
+DEFAULT_CORPORA = ('data/training_data.txt',)
+
+IVF_MIN_SIZE = 50000  # nhỏ hơn: quét toàn bộ (chính xác)
+IVF_NPROBE = 8         # số cụm được quét mỗi câu hỏi
+
+
+def index_paths(model_path: str):
+    return model_path + '.nn.npy', model_path + '.nn.json'
+
+
+def _centroids_path(model_path: str):
+    return model_path + '.nn.centroids.npy'
+
+
+def _save_npy(path: str, array):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:  # file object: np.save không tự thêm đuôi .npy
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def _read_corpus(paths):
+    """(câu đã chuẩn hoá, label) không trùng lặp, theo thứ tự file."""
+    seen = set()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line.startswith('__label__'):
+                    continue
+                label, _, text = line.partition(' ')
+                text = canonical_text(text)
+                item = (text, label.replace('__label__', ''))
+                if text and item not in seen:
+                    seen.add(item)
+                    yield item
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+def sentence_vectors(model, texts) -> np.ndarray:
+    """Ma trận (len(texts), dim) đã chuẩn hoá L2."""
+    if not texts:
+        return np.zeros((0, model.get_dimension()), dtype=np.float32)
+    return _normalize(np.stack([model.get_sentence_vector(t.replace('\n', ' ')) for t in texts]))
+
+
+def _spherical_kmeans(vectors, nlist, iterations=10, sample_per_list=64, seed=0):
+    """Centroid (nlist, dim) đã chuẩn hoá, học trên một mẫu con của vectors."""
+    rng = np.random.default_rng(seed)
+    train = vectors[np.sort(rng.choice(len(vectors), min(len(vectors), nlist * sample_per_list), replace=False))]
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        counts = np.bincount(assign, minlength=nlist)
+        nonempty = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(train[np.argsort(assign, kind='stable')], starts, axis=0)
+        empty = np.flatnonzero(~nonempty)
+        centroids[empty] = train[rng.choice(len(train), len(empty), replace=False)]
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def _assign(vectors, centroids, chunk=65536):
+    return np.concatenate([np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1)
+                           for i in range(0, len(vectors), chunk)])
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Chỉ số k phần tử lớn nhất của mảng 1 chiều, giảm dần."""
+    if k < len(scores):
+        top = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class NearestNeighbourIndex:
+    def __init__(self, matrix, texts, labels, model_version=None, centroids=None, offsets=None):
+        """
+        matrix: (N, dim) float32 đã chuẩn hoá; labels: list tên label, cùng thứ tự matrix.
+        centroids/offsets: nếu có, cụm c là các dòng [offsets[c], offsets[c+1]) của matrix.
+        """
+        self.matrix = matrix
+        self.centroids = centroids
+        self.offsets = offsets
+        self.texts = texts
+        self.label_names = sorted(set(labels))
+        label_ids = {name: i for i, name in enumerate(self.label_names)}
+        self.label_ids = np.array([label_ids[name] for name in labels], dtype=np.int32)
+        self.model_version = model_version
+
+        self.queries = 0
+        self.search_seconds = 0.0
+        self.overridden = 0  # số lần label kNN thay cho label của model
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def build(cls, model, corpus_paths=DEFAULT_CORPORA, model_version=None):
+        known = {label.replace('__label__', '') for label in model.get_labels()}
+        items = [(text, label) for text, label in _read_corpus(corpus_paths) if label in known]
+        texts = [text for text, _label in items]
+        labels = [label for _text, label in items]
+        matrix = sentence_vectors(model, texts)
+        if len(texts) < IVF_MIN_SIZE:
+            return cls(matrix, texts, labels, model_version)
+        nlist = int(np.sqrt(len(texts)))
+        centroids = _spherical_kmeans(matrix, nlist)
+        assign = _assign(matrix, centroids)
+        order = np.argsort(assign, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=nlist)))).astype(np.int64)
+        return cls(np.ascontiguousarray(matrix[order]), [texts[i] for i in order], [labels[i] for i in order],
+                   model_version, centroids, offsets)
+
+    def save(self, model_path: str):
+        """Ghi file tạm rồi os.replace: worker đang mmap file cũ vẫn đọc được bản cũ."""
+        npy_path, meta_path = index_paths(model_path)
+        _save_npy(npy_path, self.matrix)
+        meta = {
+            "model_version": self.model_version,
+            "texts": self.texts,
+            "labels": [self.label_names[i] for i in self.label_ids],
+            "offsets": self.offsets.tolist() if self.offsets is not None else None,
+        }
+        if self.centroids is not None:
+            _save_npy(_centroids_path(model_path), self.centroids)
+        tmp = meta_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, meta_path)
+
+    @classmethod
+    def load(cls, model_path: str, model_version=None):
+        """Index đã lưu cho model_path; None nếu chưa có hoặc được build từ model khác."""
+        npy_path, meta_path = index_paths(model_path)
+        if not (os.path.exists(npy_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if model_version is not None and meta.get("model_version") != model_version:
+            return None
+        matrix = np.load(npy_path, mmap_mode='r')
+        if matrix.shape[0] != len(meta["texts"]):
+            return None
+        centroids = offsets = None
+        if meta.get("offsets") is not None:
+            centroids = np.load(_centroids_path(model_path))
+            offsets = np.asarray(meta["offsets"], dtype=np.int64)
+        return cls(matrix, meta["texts"], meta["labels"], meta.get("model_version"), centroids, offsets)
+
+    @classmethod
+    def load_or_build(cls, model, model_path: str, model_version, corpus_paths=DEFAULT_CORPORA):
+        """Load index của đúng model này; không có thì build rồi lưu (lỗi ghi file thì chỉ giữ trong RAM)."""
+        index = cls.load(model_path, model_version)
+        if index is not None:
+            return index
+        index = cls.build(model, corpus_paths, model_version)
+        try:
+            index.save(model_path)
+        except OSError:
+            pass
+        return index
+
+    def search(self, queries: np.ndarray, k: int = 5, nprobe: int = IVF_NPROBE):
+        """
+        queries: (n, dim) đã chuẩn hoá. Trả về (ids, scores): mỗi hàng (tối đa k phần tử)
+        là các câu gần nhất của một câu hỏi, xếp theo cosine giảm dần.
+        """
+        t0 = time.perf_counter()
+        if len(queries) == 0 or len(self.texts) == 0:
+            ids, scores = [[] for _ in queries], [[] for _ in queries]
+        elif self.centroids is None:
+            all_scores = queries @ self.matrix.T  # (n_queries, N): 1 phép nhân cho cả lô
+            ids = [_top_k(row, k) for row in all_scores]
+            scores = [row[top] for row, top in zip(all_scores, ids)]
+        else:
+            ids, scores = self._search_ivf(queries, k, nprobe)
+        self.queries += len(queries)
+        self.search_seconds += time.perf_counter() - t0
+        return ids, scores
+
+    def _search_ivf(self, queries, k, nprobe):
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        ids, scores = [], []
+        for query, clusters in zip(queries, probes):
+            spans = [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in clusters]
+            candidates = np.concatenate([np.arange(lo, hi) for lo, hi in spans])
+            candidate_scores = np.concatenate([self.matrix[lo:hi] @ query for lo, hi in spans])
+            top = _top_k(candidate_scores, k)
+            ids.append(candidates[top])
+            scores.append(candidate_scores[top])
+        return ids, scores
+
+    def vote(self, ids, scores):
+        """Label có tổng cosine lớn nhất trong các láng giềng → (label, tỉ lệ phiếu)."""
+        if len(ids) == 0:
+            return None, 0.0
+        weights = np.maximum(np.asarray(scores, dtype=np.float64), 0.0)
+        totals = np.bincount(self.label_ids[ids], weights=weights, minlength=len(self.label_names))
+        best = int(np.argmax(totals))
+        total = totals.sum()
+        return self.label_names[best], float(totals[best] / total) if total > 0 else 0.0
+
+    def neighbours(self, ids, scores, limit=3):
+        """Gợi ý "có phải bạn muốn hỏi": tối đa limit câu khác nhau, gần nhất trước."""
+        out = []
+        seen = set()
+        for i, score in zip(ids, scores):
+            text = self.texts[i]
+            if text in seen:
+                continue
+            seen.add(text)
+            out.append({"text": text, "intent": self.label_names[self.label_ids[i]], "score": round(float(score), 4)})
+            if len(out) >= limit:
+                break
+        return out
+
+    def stats(self):
+        return {
+            "size": len(self.texts),
+            "dim": int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0,
+            "clusters": len(self.centroids) if self.centroids is not None else 0,
+            "model_version": self.model_version,
+            "mmap": isinstance(self.matrix, np.memmap),
+            "queries": self.queries,
+            "overridden": self.overridden,
+            "avg_search_ms": round(self.search_seconds / self.queries * 1000, 4) if self.queries else 0.0,
+        }
+
+
+def low_confidence_fallback(index, model, texts, predictions, threshold, k=5, min_similarity=0.8):
+    """
+    predictions: [(intent, confidence, model_version)] của model cho texts.
+    Các câu có confidence < threshold được tra index trong 1 lần search; trả về
+    [(intent, confidence, model_version, extra)] cùng thứ tự, extra là None hoặc
+    {"suggestions": [...]}. Nếu câu gần nhất có cosine >= min_similarity và kNN bỏ
+    phiếu cho label khác thì dùng label đó (confidence = tỉ lệ phiếu, "fallback": "knn").
+    model phải là model đã dùng để build index (cùng model_version).
+    """
+    out = [(intent, confidence, version, None) for intent, confidence, version in predictions]
+    low = [i for i, (_intent, confidence, _version) in enumerate(predictions) if confidence < threshold]
+    if not low or len(index) == 0:
+        return out
+    ids, scores = index.search(sentence_vectors(model, [canonical_text(texts[i]) for i in low]), k)
+    for row, i in enumerate(low):
+        intent, confidence, version = predictions[i]
+        extra = {"suggestions": index.neighbours(ids[row], scores[row])}
+        label, share = index.vote(ids[row], scores[row])
+        if label is not None and label != intent and len(scores[row]) and scores[row][0] >= min_similarity:
+            index.overridden += 1
+            extra["fallback"] = "knn"
+            extra["model_intent"] = intent
+            intent, confidence = label, share
+        out[i] = (intent, confidence, version, extra)
+    return out
+
+
+def main():
+    from model_manager import model_version
+    from model_utils import load_intent_model, resolve_model_path
+
+    parser = argparse.ArgumentParser(description="Build chỉ mục láng giềng gần nhất cho model fastText")
+    parser.add_argument('--model', default=None, help="file model (mặc định như API)")
+    parser.add_argument('--corpus', nargs='+', default=list(DEFAULT_CORPORA))
+    args = parser.parse_args()
+
+    model_path = resolve_model_path(args.model)
+    model = load_intent_model(model_path)
+    t0 = time.perf_counter()
+    index = NearestNeighbourIndex.build(model, args.corpus, model_version(model_path))
+    index.save(model_path)
+    print(f"✅ {len(index)} câu, dim={index.matrix.shape[1]} ({time.perf_counter() - t0:.1f}s) "
+          f"→ {index_paths(model_path)[0]}")
+
+
+if __name__ == '__main__':
+    main()
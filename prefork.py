@@ -0,0 +1,119 @@
+"""
+Chạy WSGIServer (gevent) theo kiểu pre-fork: process master load model một lần,
+mở socket, rồi fork N worker cùng accept trên socket đó. Bộ nhớ của model được
+chia sẻ copy-on-write giữa các worker.
+
+Master chỉ giám sát: worker chết bất thường thì fork lại; nhận SIGTERM/SIGINT thì
+chuyển SIGTERM cho worker, chờ worker xử lý xong request đang chạy rồi thoát.
+
+Mỗi worker có số thứ tự cố định 0..N-1 (worker fork lại dùng lại số của worker đã
+chết), truyền cho on_worker_start(worker): VD để mở cổng /metrics riêng cho từng worker.
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+RESPAWN_BACKOFF = 1.0  # worker chết ngay sau khi start → chờ trước khi fork lại
+
+
+def _listen(address, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def _run_worker(listener, app, worker, on_worker_start, graceful_timeout):
+    import gevent
+    from gevent.pywsgi import WSGIServer
+
+    server = WSGIServer(listener, app)
+
+    def stop():
+        # Ngừng nhận kết nối mới, chờ request đang chạy tối đa graceful_timeout giây.
+        # Callback của signal_handler chạy trên hub nên phải spawn greenlet để chờ.
+        gevent.spawn(server.stop, timeout=graceful_timeout)
+
+    gevent.signal_handler(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C do master xử lý
+    if on_worker_start is not None:
+        on_worker_start(worker)
+    server.serve_forever()
+
+
+def serve_prefork(app, address, workers, on_worker_start=None, graceful_timeout=10.0):
+    listener = _listen(address)
+    # Đưa các object đã có vào "permanent generation" để GC ở worker không ghi
+    # lên các trang bộ nhớ dùng chung (tránh copy-on-write không cần thiết)
+    gc.collect()
+    gc.freeze()
+
+    children = {}  # pid -> (thời điểm fork, số thứ tự worker)
+    stopping = False
+
+    def spawn(worker):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(listener, app, worker, on_worker_start, graceful_timeout)
+            except BaseException as e:
+                print(f"Worker {os.getpid()} error:", e, file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (time.monotonic(), worker)
+        print(f"👷 Worker {worker} (pid {pid}) started")
+
+    def shutdown(*_args):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        print("🛑 Shutting down workers...")
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for worker in range(workers):
+        spawn(worker)
+
+    deadline = None
+    while children:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + graceful_timeout + 5
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                for child in list(children):
+                    try:
+                        os.kill(child, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+            time.sleep(0.2)
+            continue
+
+        child = children.pop(pid, None)
+        if stopping or child is None:
+            continue
+        started, worker = child
+        print(f"⚠️  Worker {worker} (pid {pid}) exited (status {status}), restarting")
+        if time.monotonic() - started < RESPAWN_BACKOFF:
+            time.sleep(RESPAWN_BACKOFF)
+        spawn(worker)
+
+    listener.close()
+    print("👋 Master exited")
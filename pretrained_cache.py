@@ -0,0 +1,128 @@
+"""
+Cắt bớt pre-trained vectors (cc.vi.300.vec, hàng triệu dòng) chỉ còn các từ
+xuất hiện trong corpus huấn luyện, để train_supervised(pretrainedVectors=...)
+không phải parse toàn bộ file mỗi lần train.
+
+Đầu ra (cạnh file .vec gốc, VD models/pretrained/cc.vi.300.pruned.*):
+    .pruned.vec        file .vec nhỏ, đưa thẳng cho fastText
+    .pruned.meta.json  fingerprint corpus + file gốc; khác đi thì build lại
+
+Ảnh hưởng tới từ ngoài corpus: fastText thêm mọi từ của file .vec vào dictionary của
+model, nên với file đầy đủ một từ chưa gặp lúc train nhưng có trong cc.vi vẫn giữ vector
+pre-trained. Sau khi cắt, từ đó chỉ còn vector ghép từ n-gram ký tự (học từ corpus),
+giống mọi từ OOV khác; vector n-gram không lấy từ file .vec nên giữ thêm từ "có chung
+n-gram" cũng không đổi gì. Cần giữ vector của các từ đó thì train với --no-prune.
+"""
+import hashlib
+import json
+import os
+
+DEFAULT_CORPORA = ('data/training_data.txt', 'data/training_data2.txt')
+# fastText luôn có token kết thúc câu trong dictionary
+_EXTRA_TOKENS = ('</s>',)
+
+
+def corpus_vocab(corpus_paths) -> set:
+    vocab = set(_EXTRA_TOKENS)
+    for path in corpus_paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                for token in line.split():
+                    if token.startswith('__label__'):
+                        continue
+                    vocab.add(token)
+                    vocab.add(token.lower())
+    return vocab
+
+
+def fingerprint(vec_path, corpus_paths) -> str:
+    h = hashlib.sha1()
+    st = os.stat(vec_path)
+    h.update(f"{os.path.abspath(vec_path)}|{st.st_size}|{st.st_mtime_ns}".encode())
+    for path in sorted(corpus_paths):
+        h.update(path.encode())
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha1(f.read()).digest())
+    return h.hexdigest()
+
+
+def cache_prefix(vec_path) -> str:
+    return os.path.splitext(vec_path)[0] + '.pruned'
+
+
+def _write_atomic(path, write):
+    tmp = path + '.tmp'
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_json(path, obj):
+    def write(tmp):
+        with open(tmp, 'w', encoding='utf-8') as out:
+            json.dump(obj, out, ensure_ascii=False, indent=2)
+
+    _write_atomic(path, write)
+
+
+def build_pruned_vectors(vec_path, corpus_paths, prefix=None):
+    """Đọc file .vec một lượt, chép nguyên dòng của các từ có trong corpus (không parse số thực)."""
+    prefix = prefix or cache_prefix(vec_path)
+    vocab = corpus_vocab(corpus_paths)
+    lines = []
+    with open(vec_path, 'rb') as f:
+        header = f.readline().split()
+        dim = int(header[1])
+        for line in f:
+            line = line.rstrip(b'\n')
+            word, _, rest = line.partition(b' ')
+            try:
+                word = word.decode('utf-8')
+            except UnicodeDecodeError:
+                continue
+            if word not in vocab or len(rest.split()) != dim:
+                continue
+            lines.append(line)
+
+    def write_vec(tmp):
+        with open(tmp, 'wb') as out:
+            out.write(f"{len(lines)} {dim}\n".encode())
+            for line in lines:
+                out.write(line + b'\n')
+
+    _write_atomic(prefix + '.vec', write_vec)
+    # meta ghi sau cùng: chỉ khi đủ file thì cache mới được coi là hợp lệ
+    meta = {
+        "source": vec_path,
+        "corpora": list(corpus_paths),
+        "fingerprint": fingerprint(vec_path, corpus_paths),
+        "words": len(lines),
+        "corpus_vocab": len(vocab),
+        "dim": dim,
+    }
+    _write_json(prefix + '.meta.json', meta)
+    return prefix + '.vec'
+
+
+def pruned_vectors(vec_path, corpus_paths=DEFAULT_CORPORA):
+    """
+    Trả về đường dẫn .vec đã cắt gọn cho corpus hiện tại.
+    Dùng lại cache nếu corpus và file gốc không đổi, ngược lại build lại.
+    """
+    prefix = cache_prefix(vec_path)
+    meta_path = prefix + '.meta.json'
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == fingerprint(vec_path, corpus_paths):
+            if os.path.exists(prefix + '.vec'):
+                print(f"✅ Using cached pruned vectors: {prefix}.vec ({meta['words']} words)")
+                return prefix + '.vec'
+
+    print(f"⏳ Pruning {vec_path} to corpus vocabulary...")
+    path = build_pruned_vectors(vec_path, corpus_paths, prefix)
+    print(f"✅ Pruned vectors saved: {path}")
+    return path
+
@@ -0,0 +1,92 @@
+"""
+Bảng kết quả dựng sẵn cho các cụm thời gian tương đối ("hôm nay", "tháng trước",
+"quý này", ...). Trong cùng một ngày (giờ VN) các cụm này luôn ra cùng một khoảng
+cho mọi người dùng, nên bảng được tính lúc khởi động và lại lúc 0h mỗi ngày; lúc
+request chỉ còn tra dict, không tính ngày tháng, không gọi Duckling.
+
+vi_time_parser.parse_time tra bảng khi câu chỉ có một cụm tương đối (không nằm
+trong "từ ... đến ..."); cụm không có trong CATALOGUE vẫn được tính như cũ.
+"""
+import threading
+import time
+from datetime import datetime
+
+from time_utils import TZ, _next_local_midnight
+
+CATALOGUE = (
+    "hôm nay", "hôm qua", "hôm kia",
+    "tuần này", "tuần trước", "tuần sau",
+    "tháng này", "tháng sau", "tháng trước", "tháng trước trước", "tháng trước trước trước",
+    "quý này", "quý trước",
+    "năm nay", "năm trước", "năm ngoái", "năm sau",
+)
+
+
+def _compute(expr: str, today: datetime) -> dict:
+    # Import muộn: vi_time_parser import module này
+    from vi_time_parser import _point_result, _relative_point
+    return _point_result(_relative_point(expr, today))
+
+
+class RelativeDateTable:
+    def __init__(self, catalogue=CATALOGUE, tz=TZ, compute=_compute):
+        self.catalogue = frozenset(catalogue)
+        self.tz = tz
+        self.compute = compute
+        self._state = (None, {})  # (ngày của bảng, expr -> dict); đổi cả cặp một lần
+        self._refresher = None
+
+        self.refreshes = 0
+        self.hits = 0
+        self.bypassed = 0  # ngày hỏi khác ngày của bảng (VD now truyền vào khác hôm nay)
+
+    def refresh(self, now: datetime = None):
+        now = (now or datetime.now(self.tz)).astimezone(self.tz)
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self._state = (today.date(), {expr: self.compute(expr, today) for expr in self.catalogue})
+        self.refreshes += 1
+
+    def get(self, expr: str, today: datetime):
+        """
+        Kết quả của expr (đã chuẩn hoá khoảng trắng) tại ngày today, hoặc None nếu expr
+        không có trong bảng / today không phải hôm nay. Trả về bản sao, caller sửa thoải mái.
+        """
+        if expr not in self.catalogue:
+            return None
+        day, table = self._state
+        if day != today.date():
+            if today.date() != datetime.now(self.tz).date():
+                self.bypassed += 1
+                return None
+            # Qua 0h mà luồng làm mới chưa kịp chạy
+            self.refresh()
+            day, table = self._state
+        self.hits += 1
+        return dict(table[expr])
+
+    def start_refresher(self):
+        """Thread nền làm mới bảng ngay sau mỗi 0h (giờ TZ). Gọi lại trong từng worker sau fork."""
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self.refresh()
+        self._refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            now = datetime.now(self.tz)
+            time.sleep(max(0.0, (_next_local_midnight(now) - now).total_seconds()) + 0.05)
+            self.refresh()
+
+    def stats(self):
+        day, table = self._state
+        return {
+            "date": day.isoformat() if day else None,
+            "entries": len(table),
+            "refreshes": self.refreshes,
+            "hits": self.hits,
+            "bypassed": self.bypassed,
+        }
+
+
+table = RelativeDateTable()
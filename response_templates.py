@@ -0,0 +1,146 @@
+"""
+Registry câu trả lời theo intent, nạp một lần từ templates/responses.json.
+
+Mỗi intent có "text" (có thể chứa placeholder dạng {ten}) và tuỳ chọn
+"default_time" = khoảng thời gian mặc định khi câu hỏi không nêu ngày.
+Câu trả lời không có placeholder được giữ nguyên chuỗi, lúc request chỉ tra dict.
+Placeholder chỉ được tính khi template của intent được chọn có dùng tới:
+
+    {today}       ngày hôm nay             dd/mm/yyyy
+    {date}        ngày (đầu) của time_info dd/mm/yyyy
+    {weekday}     thứ của {date}           "Thứ 2" ... "Chủ nhật"
+    {start_date}  đầu khoảng thời gian     dd/mm/yyyy
+    {end_date}    cuối khoảng thời gian    dd/mm/yyyy
+    {month_label} tháng của {start_date}   mm/yyyy
+"""
+import json
+import string
+from datetime import datetime, timedelta
+
+from time_utils import TZ, _add_months, _end_of_month, _iso_to_dt, _to_iso
+
+DATE_FMT = "%d/%m/%Y"
+_WEEKDAYS = ("Thứ 2", "Thứ 3", "Thứ 4", "Thứ 5", "Thứ 6", "Thứ 7", "Chủ nhật")
+
+
+def default_period(kind: str, now: datetime):
+    """(start, end) của khoảng thời gian mặc định theo tên, tính theo ngày của now."""
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind == "yesterday":
+        day = today - timedelta(days=1)
+        return day, day
+    if kind == "month":
+        start = today.replace(day=1)
+        return start, _end_of_month(start)
+    if kind == "month_to_date":
+        return today.replace(day=1), today
+    if kind == "year":
+        start = today.replace(month=1, day=1)
+        return start, _add_months(start, 12) - timedelta(seconds=1)
+    if kind == "year_to_date":
+        return today.replace(month=1, day=1), today
+    return today, today
+
+
+def default_time_info(kind: str, now: datetime) -> dict:
+    """default_period dưới dạng của normalize_duckling_times (end là cuối ngày, inclusive)."""
+    start, end = default_period(kind, now)
+    if kind in ("today", "yesterday"):
+        return {"type": "single", "date": _to_iso(start), "grain": "day"}
+    end = end.replace(hour=23, minute=59, second=59)
+    info = {"type": "range", "start": _to_iso(start), "end": _to_iso(end)}
+    if kind in ("month", "year"):
+        info["grain"] = kind
+    return info
+
+
+def _period(time_info, default_time, now):
+    if time_info:
+        if time_info.get("type") == "range" and time_info.get("start") and time_info.get("end"):
+            return _iso_to_dt(time_info["start"]).astimezone(TZ), _iso_to_dt(time_info["end"]).astimezone(TZ)
+        if time_info.get("type") == "single" and time_info.get("date"):
+            day = _iso_to_dt(time_info["date"]).astimezone(TZ)
+            return day, day
+    return default_period(default_time, now)
+
+
+class _Placeholders(dict):
+    """Tính giá trị placeholder khi format_map cần tới (lazy)."""
+
+    def __init__(self, time_info, default_time):
+        super().__init__()
+        self.time_info = time_info
+        self.default_time = default_time
+        self._now = None
+        self._range = None
+
+    def _get_now(self):
+        if self._now is None:
+            self._now = datetime.now(TZ)
+        return self._now
+
+    def _get_range(self):
+        if self._range is None:
+            self._range = _period(self.time_info, self.default_time, self._get_now())
+        return self._range
+
+    def __missing__(self, key):
+        if key == "today":
+            value = self._get_now().strftime(DATE_FMT)
+        elif key in ("date", "start_date"):
+            value = self._get_range()[0].strftime(DATE_FMT)
+        elif key == "end_date":
+            value = self._get_range()[1].strftime(DATE_FMT)
+        elif key == "weekday":
+            value = _WEEKDAYS[self._get_range()[0].weekday()]
+        elif key == "month_label":
+            value = self._get_range()[0].strftime("%m/%Y")
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+
+class TemplateRegistry:
+    def __init__(self, intents: dict, fallback: str):
+        self.fallback = fallback
+        self.static = {}     # intent -> câu trả lời cố định
+        self.dynamic = {}    # intent -> (template, default_time)
+        self.default_times = {}
+        for intent, entry in intents.items():
+            text = entry["text"]
+            default_time = entry.get("default_time")
+            if default_time:
+                self.default_times[intent] = default_time
+            fields = {name for _lit, name, _spec, _conv in string.Formatter().parse(text) if name}
+            if fields:
+                self.dynamic[intent] = (text, default_time)
+            else:
+                self.static[intent] = text
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["intents"], data["fallback"])
+
+    def default_time_info(self, intent: str, now: datetime = None):
+        """Khoảng thời gian mặc định của intent (None nếu intent không khai báo default_time)."""
+        default_time = self.default_times.get(intent)
+        if default_time is None:
+            return None
+        return default_time_info(default_time, now or datetime.now(TZ))
+
+    def period(self, intent: str, time_info: dict = None, now: datetime = None):
+        """(start, end) mà câu trả lời của intent nói tới: time_info, không có thì default_time."""
+        return _period(time_info, self.default_times.get(intent), now or datetime.now(TZ))
+
+    def render(self, intent: str, time_info: dict = None) -> str:
+        text = self.static.get(intent)
+        if text is not None:
+            return text
+        entry = self.dynamic.get(intent)
+        if entry is None:
+            return self.fallback
+        template, default_time = entry
+        return template.format_map(_Placeholders(time_info, default_time))
@@ -1,5 +1,8 @@
 import fasttext # type: ignore
 import re
+from datetime import datetime
+
+from vi_time_parser import TZ, parse_time
 
 # Load model đã train với date patterns
 model = fasttext.load_model('models/intent_model.bin')
@@ -37,5 +40,35 @@ def test_date_understanding():
     print("✅ 'tháng 9', 'tháng 10' → temporal expressions")
     print("✅ Các biến thể date format đều thuộc NGAYCONG_FROMTO")
 
+def test_fast_time_parser():
+    # Câu còn bổ ngữ thời gian ngoài mẫu khớp → None (để Duckling xử lý), không trả mốc sai
+    now = datetime(2025, 10, 20, 10, 0, tzinfo=TZ)
+    unparsed = [
+        "tháng 10 năm ngoái",
+        "5/10 năm ngoái",
+        "3 tháng trước",
+        "2 tháng trước",
+        "thứ 2 tuần trước",
+        "tháng 8 và tháng 9",
+        "từ 30/10 đến 5",
+    ]
+    expected = {
+        "chấm công tháng 9": ("2025-09-01T00:00:00+07:00", "2025-09-30T23:59:59+07:00"),
+        "từ 5 đến 10/10": ("2025-10-05T00:00:00+07:00", "2025-10-10T23:59:59+07:00"),
+        "từ 15/12 đến 5/1": ("2025-12-15T00:00:00+07:00", "2026-01-05T23:59:59+07:00"),
+        "từ ngày 1 tháng 9 đến ngày 30 tháng 9": ("2025-09-01T00:00:00+07:00", "2025-09-30T23:59:59+07:00"),
+    }
+
+    print("\n🕒 Testing vi_time_parser:")
+    for text in unparsed:
+        result = parse_time(text, now)
+        print(f"   '{text}' → {result}")
+        assert result is None, text
+    for text, (start, end) in expected.items():
+        result = parse_time(text, now)
+        print(f"   '{text}' → {result}")
+        assert (result["start"], result["end"]) == (start, end), text
+
 if __name__ == "__main__":
-    test_date_understanding()
\ No newline at end of file
+    test_date_understanding()
+    test_fast_time_parser()
\ No newline at end of file
@@ -0,0 +1,14 @@
+"""Chuẩn hoá câu người dùng để làm khoá cache / tra cứu."""
+import re
+import unicodedata
+
+_WS_RE = re.compile(r"\s+")
+# Dấu câu cuối câu không ảnh hưởng tới ý định: "xin chào!!", "bạn là ai ?"
+_TRAILING_PUNCT_RE = re.compile(r"[\s.,!?;:…~]+$")
+
+
+def canonical_text(text: str) -> str:
+    """NFC + chữ thường + gộp khoảng trắng + bỏ dấu câu cuối câu."""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = _WS_RE.sub(" ", text).strip()
+    return _TRAILING_PUNCT_RE.sub("", text)
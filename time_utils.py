@@ -0,0 +1,147 @@
+"""
+Tiện ích thời gian dùng chung: chuẩn hoá kết quả Duckling về dạng
+{"type": "range"|"single"|"none", ...} và các phép tính theo grain.
+"""
+import logging
+from datetime import datetime, timezone, timedelta
+
+log = logging.getLogger(__name__)
+
+TZ = timezone(timedelta(hours=7))  # Asia/Ho_Chi_Minh
+
+def _next_local_midnight(now: datetime) -> datetime:
+    midnight = now.astimezone(TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + timedelta(days=1)
+
+def _iso_to_dt(s: str) -> datetime:
+    # Hỗ trợ cả 'Z'
+    s = s.replace('Z', '+00:00')
+    return datetime.fromisoformat(s)
+
+def _to_iso(dt: datetime) -> str:
+    return dt.isoformat()
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    y = dt.year + (dt.month - 1 + months) // 12
+    m = (dt.month - 1 + months) % 12 + 1
+    return dt.replace(year=y, month=m, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _end_of_month(dt: datetime) -> datetime:
+    first_next = _add_months(dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 1)
+    return first_next - timedelta(seconds=1)
+
+def _expand_grain_interval(val_iso: str, grain: str, inclusive_end: bool = True, tz: timezone = TZ):
+    base = _iso_to_dt(val_iso).astimezone(tz)
+
+    if grain == "day":
+        start = base.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=1)
+        if inclusive_end:
+            end = end - timedelta(seconds=1)
+        return _to_iso(start), _to_iso(end)
+
+    if grain == "week":
+        # Duckling thường trả đầu tuần; ta chuẩn hoá: start = ngày đó 00:00
+        start = base.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=7)
+        if inclusive_end:
+            end = end - timedelta(seconds=1)
+        return _to_iso(start), _to_iso(end)
+
+    if grain == "month":
+        start = base.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if inclusive_end:
+            end_dt = _end_of_month(start)
+        else:
+            end_dt = _add_months(start, 1)  # exclusive
+        return _to_iso(start), _to_iso(end_dt)
+
+    if grain == "quarter":
+        # Tính quý: 1–3, 4–6, 7–9, 10–12
+        q = (base.month - 1) // 3
+        start_month = q * 3 + 1
+        start = base.replace(month=start_month, day=1, hour=0, minute=0, second=0, microsecond=0)
+        if inclusive_end:
+            end_dt = _add_months(start, 3) - timedelta(seconds=1)
+        else:
+            end_dt = _add_months(start, 3)
+        return _to_iso(start), _to_iso(end_dt)
+
+    if grain == "year":
+        start = base.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        if inclusive_end:
+            end_dt = start.replace(year=start.year + 1) - timedelta(seconds=1)
+        else:
+            end_dt = start.replace(year=start.year + 1)
+        return _to_iso(start), _to_iso(end_dt)
+
+    # Mặc định: coi như single
+    return val_iso, val_iso
+
+def normalize_duckling_times(resp: list, inclusive_end: bool = True, tz: timezone = TZ):
+    """
+    Hỗ trợ cả 2 dạng:
+    - item["values"] (list candidates)
+    - item["value"] (single object), có thể chứa 'values' bên trong.
+    """
+    if not resp:
+        return {"type": "none"}
+
+    # Nhiều mốc thời gian riêng biệt (VD: "từ tháng 1 đến tháng 9") → gộp thành
+    # một khoảng: đầu mốc đứng trước tới cuối mốc đứng sau trong câu
+    times = sorted((x for x in resp if x.get("dim", "time") == "time"), key=lambda x: x.get("start", 0))
+    if len(times) >= 2:
+        try:
+            first, last = times[0].get("value", {}), times[-1].get("value", {})
+            if first.get("value") and last.get("value"):
+                last_grain = last.get("grain", "day")
+                start, _ = _expand_grain_interval(first["value"], first.get("grain", "day"), inclusive_end=False, tz=tz)
+                _, end = _expand_grain_interval(last["value"], last_grain, inclusive_end=inclusive_end, tz=tz)
+                return {"type": "range", "start": start, "end": end, "grain": last_grain}
+        except Exception as e:
+            log.warning("duckling.multi_time_error", extra={"fields": {"error": str(e)}})
+
+    # Ưu tiên dim='time'
+    item = next((x for x in resp if x.get("dim") == "time"), resp[0])
+
+    # Lấy primary candidate
+    primary = None
+    top_values = item.get("values")
+    top_value = item.get("value")
+
+    if isinstance(top_values, list) and top_values:
+        primary = top_values[0]
+    elif isinstance(top_value, dict):
+        # Một số bản trả 'value' là object duy nhất; đôi khi value còn chứa 'values'
+        if isinstance(top_value.get("values"), list) and top_value["values"]:
+            primary = top_value["values"][0]
+        else:
+            primary = top_value
+
+    if not isinstance(primary, dict):
+        return {"type": "none"}
+
+    typ = primary.get("type")
+    grain = primary.get("grain")
+
+    # Interval (từ...đến...)
+    if typ == "interval":
+        start_iso = primary.get("from", {}).get("value")
+        end_iso = primary.get("to", {}).get("value")
+        # Nếu muốn inclusive end theo grain (nếu Duckling trả grain ở from/to)
+        if inclusive_end and end_iso:
+            # Cố gắng dùng grain nếu có ở 'to', nếu không dùng 'day'
+            end_grain = primary.get("to", {}).get("grain") or grain or "day"
+            if end_grain in ("day", "week", "month", "quarter", "year"):
+                _s, end_iso = _expand_grain_interval(end_iso, end_grain, inclusive_end=True, tz=tz)
+        return {"type": "range", "start": start_iso, "end": end_iso}
+
+    # Value (mốc đơn). Với grain rộng → đổi thành range
+    if typ == "value":
+        val_iso = primary.get("value")
+        if grain in ("week", "month", "quarter", "year"):
+            start, end = _expand_grain_interval(val_iso, grain, inclusive_end=inclusive_end, tz=tz)
+            return {"type": "range", "start": start, "end": end, "grain": grain}
+        return {"type": "single", "date": val_iso, "grain": grain}
+
+    return {"type": "none"}
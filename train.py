@@ -1,54 +1,40 @@
-import fasttext
+import argparse
+import itertools
+import json
+import multiprocessing
 import os
+import random
+import shutil
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-print("🚀 Training FastText với Pre-trained Vectors...")
-
-# Kiểm tra file vectors
-# pretrained_path = 'models/pretrained/crawl-300d-2M.vec'
-pretrained_path = 'models/pretrained/cc.vi.300.vec'
-use_pretrained = os.path.exists(pretrained_path)
+import fasttext
 
-if use_pretrained:
-    print("✅ Using pre-trained word vectors")
-else:
-    print("⚠️  Training from scratch (no pre-trained vectors)")
+from model_manager import model_version
+from model_utils import quantized_path
+from nn_index import NearestNeighbourIndex, index_paths
+from pretrained_cache import DEFAULT_CORPORA, pruned_vectors
 
-# Train model với hoặc không có pre-trained vectors
-if use_pretrained:
-    model = fasttext.train_supervised(
-        input='data/training_data.txt',
-        epoch=50,           # Có thể giảm epoch khi dùng pre-trained
-        lr=0.5,
-        wordNgrams=2,
-        dim=300,            # Phải khớp với dimension của pre-trained vectors
-        pretrainedVectors=pretrained_path,
-        minCount=1,
-        minn=2,
-        maxn=5,
-        verbose=2
-    )
-else:
-    model = fasttext.train_supervised(
-        input='data/training_data.txt',
-        epoch=100,
-        lr=0.5,
-        wordNgrams=2,
-        dim=100,            # Có thể dùng dimension nhỏ hơn
-        minCount=1,
-        minn=2,
-        maxn=5,
-        verbose=2
-    )
+TRAIN_FILE = 'data/training_data.txt'
+MODEL_PATH = 'models/intent_model.bin'
+# pretrained_path = 'models/pretrained/crawl-300d-2M.vec'
+PRETRAINED_PATH = 'models/pretrained/cc.vi.300.vec'
 
-# Lưu model
-os.makedirs('models', exist_ok=True)
-model.save_model('models/intent_model.bin')
-print("✅ Model saved: models/intent_model.bin")
+# Không gian tìm kiếm cho --tune grid/random
+PARAM_GRID = {
+    "epoch": [25, 50, 100],
+    "lr": [0.1, 0.5, 1.0],
+    "wordNgrams": [1, 2, 3],
+    "dim": [50, 100],
+    "minn": [0, 2, 3],
+    "maxn": [0, 4, 5],
+}
 
 # Test khả năng hiểu ngữ nghĩa
 test_cases = [
     "chào bạn",           # Test WELCOME
-    "xin chào",           # Test WELCOME  
+    "xin chào",           # Test WELCOME
     "hello",              # Test WELCOME
     "thông tin cá nhân",
     "chấm công tháng trước",
@@ -59,18 +45,368 @@ test_cases = [
     "kiểm tra công tháng 8"
 ]
 
-print(f"\n🧪 Testing Semantic Understanding (Pre-trained: {use_pretrained}):")
-for text in test_cases:
-    # Sửa lỗi predict - cách mới
-    predictions = model.predict(text, k=2)
-    
-    # FastText trả về tuple (labels, probabilities)
-    labels = predictions[0]
-    probabilities = predictions[1]
-    
-    print(f"📝 '{text}'")
-    for i in range(len(labels)):
-        intent = labels[i].replace('__label__', '')
-        prob = probabilities[i]
-        print(f"   → {intent}: {prob:.1%}")
-    print()
\ No newline at end of file
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train FastText intent model")
+    parser.add_argument('--input', default=TRAIN_FILE, help="file huấn luyện (định dạng __label__)")
+    parser.add_argument('--output', default=MODEL_PATH, help="đường dẫn model .bin")
+    parser.add_argument('--no-prune', action='store_true', help="dùng nguyên file pre-trained .vec, không cắt theo corpus")
+    parser.add_argument('--quantize', action='store_true', help="xuất thêm model quantize .ftz")
+    parser.add_argument('--cutoff', type=int, default=0, help="quantize: giữ tối đa N từ/ngram (0 = giữ hết)")
+    parser.add_argument('--qnorm', action='store_true', help="quantize: quantize riêng norm của vector")
+    parser.add_argument('--retrain', action='store_true', help="quantize: fine-tune lại sau khi cắt bớt từ (cần --cutoff)")
+    parser.add_argument('--dsub', type=int, default=2, help="quantize: kích thước sub-vector của product quantizer")
+    parser.add_argument('--valid', default=None, help="--quantize: file held-out (không có trong --input) để đo accuracy trong báo cáo")
+    parser.add_argument('--report', default='models/quantize_report.json', help="nơi ghi báo cáo so sánh .bin/.ftz")
+    parser.add_argument('--tune', choices=['grid', 'random', 'autotune'], help="tìm hyperparameter trên tập validation")
+    parser.add_argument('--trials', type=int, default=30, help="--tune random: số tổ hợp thử")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="--tune grid/random: số process chạy song song")
+    parser.add_argument('--valid-ratio', type=float, default=0.2, help="--tune: tỉ lệ tách validation theo từng label")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--autotune-duration', type=int, default=300, help="--tune autotune: giới hạn thời gian (giây)")
+    parser.add_argument('--autotune-model-size', default=None, help="--tune autotune: giới hạn kích thước model, VD 2M")
+    parser.add_argument('--leaderboard', default='models/leaderboard.json', help="--tune: nơi ghi kết quả các trial")
+    parser.add_argument('--no-refit', action='store_true', help="--tune: không train lại tham số tốt nhất trên toàn bộ corpus")
+    args = parser.parse_args()
+    # Đo trên chính tập train thì accuracy .bin/.ftz đều gần 100%, báo cáo vô nghĩa
+    if args.quantize and not args.valid:
+        parser.error("--quantize cần --valid (file held-out, VD tách bằng split_corpus)")
+    if args.valid and os.path.abspath(args.valid) == os.path.abspath(args.input):
+        parser.error("--valid phải khác --input")
+    return args
+
+
+def train(input_path, pretrained_path=None):
+    # Train model với hoặc không có pre-trained vectors
+    if pretrained_path:
+        return fasttext.train_supervised(
+            input=input_path,
+            epoch=50,           # Có thể giảm epoch khi dùng pre-trained
+            lr=0.5,
+            wordNgrams=2,
+            dim=300,            # Phải khớp với dimension của pre-trained vectors
+            pretrainedVectors=pretrained_path,
+            minCount=1,
+            minn=2,
+            maxn=5,
+            verbose=2
+        )
+    return fasttext.train_supervised(
+        input=input_path,
+        epoch=100,
+        lr=0.5,
+        wordNgrams=2,
+        dim=100,            # Có thể dùng dimension nhỏ hơn
+        minCount=1,
+        minn=2,
+        maxn=5,
+        verbose=2
+    )
+
+
+def quantize(model, input_path, args):
+    """Quantize model tại chỗ (model .bin phải được lưu trước khi gọi)."""
+    kwargs = dict(qnorm=args.qnorm, dsub=args.dsub)
+    if args.cutoff > 0:
+        kwargs['cutoff'] = args.cutoff
+        if args.retrain:
+            kwargs.update(input=input_path, retrain=True)
+    model.quantize(**kwargs)
+    return model
+
+
+def _rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _read_eval_set(path):
+    texts, labels = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith('__label__'):
+                continue
+            label, _, text = line.partition(' ')
+            texts.append(text)
+            labels.append(label)
+    return texts, labels
+
+
+def measure_model(path, eval_path, repeat=20):
+    """Chạy trong process riêng để RSS / thời gian load không bị model khác ảnh hưởng."""
+    rss_before = _rss_kb()
+    t0 = time.perf_counter()
+    model = fasttext.load_model(path)
+    load_s = time.perf_counter() - t0
+    rss_after = _rss_kb()
+
+    texts, labels = _read_eval_set(eval_path)
+    correct = sum(
+        1 for text, label in zip(texts, labels)
+        if model.predict(text, k=1)[0][0] == label
+    )
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            model.predict(text, k=1)
+    n_pred = max(1, repeat * len(texts))
+    latency_us = (time.perf_counter() - t0) / n_pred * 1e6
+
+    return {
+        "path": path,
+        "file_size_mb": round(os.path.getsize(path) / 1024 / 1024, 3),
+        "load_time_s": round(load_s, 4),
+        "rss_mb": round((rss_after - rss_before) / 1024, 1),
+        "latency_us": round(latency_us, 2),
+        "accuracy": round(correct / len(texts), 4) if texts else None,
+        "eval_examples": len(texts),
+    }
+
+
+def compare_models(paths, eval_path, report_path):
+    ctx = multiprocessing.get_context('spawn')
+    rows = []
+    for path in paths:
+        with ctx.Pool(1) as pool:
+            rows.append(pool.apply(measure_model, (path, eval_path)))
+    report = {"eval_set": eval_path, "models": rows}
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n📏 So sánh model (eval: {eval_path}):")
+    print(f"   {'file':<32} {'MB':>8} {'load s':>8} {'RSS MB':>8} {'µs/pred':>8} {'acc':>7}")
+    for r in rows:
+        print(f"   {r['path']:<32} {r['file_size_mb']:>8} {r['load_time_s']:>8} "
+              f"{r['rss_mb']:>8} {r['latency_us']:>8} {r['accuracy']:>7}")
+    print(f"✅ Report saved: {report_path}")
+    return report
+
+
+def split_corpus(input_path, valid_ratio, seed, out_dir):
+    """Tách train/validation theo từng label (stratified); label chỉ có 1 câu thì để ở train."""
+    by_label = defaultdict(list)
+    with open(input_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('__label__'):
+                by_label[line.split(' ', 1)[0]].append(line)
+
+    rng = random.Random(seed)
+    train_lines, valid_lines = [], []
+    for label in sorted(by_label):
+        lines = by_label[label]
+        rng.shuffle(lines)
+        n_valid = int(round(len(lines) * valid_ratio))
+        if len(lines) >= 2:
+            n_valid = min(max(1, n_valid), len(lines) - 1)
+        else:
+            n_valid = 0
+        valid_lines.extend(lines[:n_valid])
+        train_lines.extend(lines[n_valid:])
+    rng.shuffle(train_lines)
+
+    os.makedirs(out_dir, exist_ok=True)
+    train_path = os.path.join(out_dir, 'train.txt')
+    valid_path = os.path.join(out_dir, 'valid.txt')
+    for path, lines in ((train_path, train_lines), (valid_path, valid_lines)):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+    return train_path, valid_path
+
+
+def candidate_params(mode, n_trials, seed, pretrained_path):
+    grid = dict(PARAM_GRID)
+    if pretrained_path:
+        grid["dim"] = [300]  # phải khớp với pre-trained vectors
+    keys = list(grid)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+    # maxn phải >= minn (maxn=0 là tắt subword)
+    combos = [c for c in combos if c["maxn"] == 0 or c["maxn"] >= c["minn"]]
+    if mode == 'random':
+        random.Random(seed).shuffle(combos)
+        combos = combos[:n_trials]
+    return combos
+
+
+def evaluate(model, valid_path, model_path):
+    texts, labels = _read_eval_set(valid_path)
+    correct = sum(1 for text, label in zip(texts, labels) if model.predict(text, k=1)[0][0] == label)
+    t0 = time.perf_counter()
+    for text in texts:
+        model.predict(text, k=1)
+    latency_us = (time.perf_counter() - t0) / max(1, len(texts)) * 1e6
+    return {
+        "accuracy": round(correct / len(texts), 4) if texts else None,
+        "model_size_mb": round(os.path.getsize(model_path) / 1024 / 1024, 3),
+        "latency_us": round(latency_us, 2),
+    }
+
+
+def save_model_atomic(model, path):
+    """Ghi file tạm rồi os.replace: API đang theo dõi path (hot reload) không đọc phải file ghi dở."""
+    tmp = path + '.tmp'
+    model.save_model(tmp)
+    os.replace(tmp, path)
+
+
+def run_trial(trial_id, params, train_path, valid_path, pretrained_path, out_dir, threads):
+    t0 = time.perf_counter()
+    extra = {"pretrainedVectors": pretrained_path} if pretrained_path else {}
+    model = fasttext.train_supervised(
+        input=train_path, minCount=1, thread=threads, verbose=0, **params, **extra
+    )
+    train_s = time.perf_counter() - t0
+    model_path = os.path.join(out_dir, f'trial_{trial_id}.bin')
+    model.save_model(model_path)
+    return {"trial": trial_id, "params": params, "train_time_s": round(train_s, 3),
+            "model_path": model_path, **evaluate(model, valid_path, model_path)}
+
+
+def _rank_key(row):
+    # accuracy cao trước; bằng nhau thì model nhanh hơn, nhỏ hơn
+    return (-(row["accuracy"] or 0), row["latency_us"], row["model_size_mb"])
+
+
+def tune(args, pretrained_path):
+    out_dir = os.path.join(os.path.dirname(args.output) or '.', 'tune')
+    train_path, valid_path = split_corpus(args.input, args.valid_ratio, args.seed, out_dir)
+    print(f"🔎 Tuning ({args.tune}) — train: {train_path}, valid: {valid_path}")
+
+    if args.tune == 'autotune':
+        t0 = time.perf_counter()
+        kwargs = dict(input=train_path, autotuneValidationFile=valid_path,
+                      autotuneDuration=args.autotune_duration, verbose=2)
+        if args.autotune_model_size:
+            kwargs["autotuneModelSize"] = args.autotune_model_size
+        if pretrained_path:
+            kwargs["pretrainedVectors"] = pretrained_path
+        model = fasttext.train_supervised(**kwargs)
+        model_path = os.path.join(out_dir, 'trial_autotune' + ('.ftz' if args.autotune_model_size else '.bin'))
+        model.save_model(model_path)
+        ft_args = model.f.getArgs()
+        params = {name: getattr(ft_args, name) for name in PARAM_GRID}
+        rows = [{"trial": "autotune", "params": params,
+                 "train_time_s": round(time.perf_counter() - t0, 3),
+                 "model_path": model_path, **evaluate(model, valid_path, model_path)}]
+    else:
+        combos = candidate_params(args.tune, args.trials, args.seed, pretrained_path)
+        workers = max(1, min(args.workers, len(combos)))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"   {len(combos)} trials, {workers} workers x {threads} threads")
+        rows = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(run_trial, i, params, train_path, valid_path, pretrained_path, out_dir, threads)
+                for i, params in enumerate(combos)
+            ]
+            for future in as_completed(futures):
+                row = future.result()
+                rows.append(row)
+                print(f"   trial {row['trial']:>3}: acc={row['accuracy']} "
+                      f"{row['latency_us']}µs {row['model_size_mb']}MB {row['params']}")
+
+    rows.sort(key=_rank_key)
+    best = rows[0]
+    for row in rows[1:]:
+        if os.path.exists(row["model_path"]):
+            os.remove(row["model_path"])
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    if args.no_refit or args.tune == 'autotune':
+        shutil.copyfile(best["model_path"], args.output + '.tmp')
+        os.replace(args.output + '.tmp', args.output)
+    else:
+        # Train lại tham số tốt nhất trên toàn bộ corpus
+        extra = {"pretrainedVectors": pretrained_path} if pretrained_path else {}
+        model = fasttext.train_supervised(input=args.input, minCount=1, verbose=0, **best["params"], **extra)
+        save_model_atomic(model, args.output)
+    print(f"🏆 Best trial {best['trial']}: acc={best['accuracy']} {best['params']}")
+    print(f"✅ Model saved: {args.output}")
+
+    with open(args.leaderboard, 'w', encoding='utf-8') as f:
+        json.dump({"mode": args.tune, "train_set": train_path, "valid_set": valid_path,
+                   "best": best, "trials": rows}, f, ensure_ascii=False, indent=2)
+    print(f"✅ Leaderboard saved: {args.leaderboard}")
+    return best
+
+
+def save_nn_index(model, model_path, corpora):
+    """Index láng giềng gần nhất (nn_index.py) cho đúng file model vừa lưu, để API chỉ cần mmap."""
+    index = NearestNeighbourIndex.build(model, corpora, model_version(model_path))
+    index.save(model_path)
+    print(f"✅ NN index saved: {index_paths(model_path)[0]} ({len(index)} câu)")
+
+
+def run_test_cases(model, use_pretrained):
+    print(f"\n🧪 Testing Semantic Understanding (Pre-trained: {use_pretrained}):")
+    for text in test_cases:
+        # Sửa lỗi predict - cách mới
+        predictions = model.predict(text, k=2)
+
+        # FastText trả về tuple (labels, probabilities)
+        labels = predictions[0]
+        probabilities = predictions[1]
+
+        print(f"📝 '{text}'")
+        for i in range(len(labels)):
+            intent = labels[i].replace('__label__', '')
+            prob = probabilities[i]
+            print(f"   → {intent}: {prob:.1%}")
+        print()
+
+
+def main():
+    args = parse_args()
+    print("🚀 Training FastText với Pre-trained Vectors...")
+
+    # Kiểm tra file vectors
+    use_pretrained = os.path.exists(PRETRAINED_PATH)
+    if use_pretrained:
+        print("✅ Using pre-trained word vectors")
+    else:
+        print("⚠️  Training from scratch (no pre-trained vectors)")
+
+    pretrained_path = None
+    if use_pretrained:
+        pretrained_path = PRETRAINED_PATH
+        if not args.no_prune:
+            # Chỉ giữ vector của các từ có trong corpus → load nhanh hơn nhiều
+            corpora = list(dict.fromkeys([*DEFAULT_CORPORA, args.input]))
+            pretrained_path = pruned_vectors(PRETRAINED_PATH, corpora)
+
+    if args.tune:
+        tune(args, pretrained_path)
+        return
+
+    model = train(args.input, pretrained_path)
+
+    # Lưu model
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    save_model_atomic(model, args.output)
+    print(f"✅ Model saved: {args.output}")
+    # Chỉ corpus vừa train: label của corpus khác có thể không có trong model
+    corpora = [args.input]
+    save_nn_index(model, args.output, corpora)
+
+    run_test_cases(model, use_pretrained)
+
+    if args.quantize:
+        ftz_path = quantized_path(args.output)
+        quantize(model, args.input, args)
+        save_model_atomic(model, ftz_path)
+        print(f"✅ Quantized model saved: {ftz_path}")
+        save_nn_index(model, ftz_path, corpora)
+        compare_models([args.output, ftz_path], args.valid, args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+Parser thời gian tiếng Việt chạy trong process, dùng trước Duckling.
+
+Chỉ xử lý các mẫu hay gặp (xem data/training_data.txt, test_date_understanding.py):
+    "05/10", "5-10", "05/10/2025", "ngày 1 tháng 9 (năm 2025)"
+    "tháng 9", "tháng 9 năm 2025", "tháng 9/2025", "năm 2025"
+    "đầu tháng 10", "cuối tháng"
+    "hôm nay", "hôm qua", "hôm kia"
+    "tuần này/trước/sau", "tháng này/sau", "tháng trước (trước)*",
+    "quý này/trước", "năm nay/trước/ngoái/sau"
+    "(từ) X đến/tới Y" với X, Y là các mẫu trên hoặc số ngày trần ("từ 1 đến 30")
+
+Kết quả cùng dạng với normalize_duckling_times. Không khớp mẫu nào, hoặc phần còn
+lại của câu vẫn có từ chỉ thời gian/số ("tháng 10 năm ngoái", "3 tháng trước",
+"thứ 2 tuần trước", "tháng 8 và tháng 9") thì trả None để caller gọi Duckling. Cụm tương đối đứng một mình lấy từ bảng dựng sẵn trong
+relative_dates (làm mới lúc 0h).
+
+Khác Duckling: ngày/tháng không ghi năm được hiểu là năm hiện tại (truy vấn
+chấm công/phép thường hỏi về quá khứ), không nhảy sang năm sau.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from relative_dates import table as relative_table
+from text_norm import canonical_text
+from time_utils import TZ, _add_months, _end_of_month, _expand_grain_interval, _to_iso
+
+_DMY = r"\d{1,2}[/-]\d{1,2}(?:[/-]\d{4})?"
+_NGAY_THANG = r"ngày\s+\d{1,2}\s+tháng\s+\d{1,2}(?:\s+năm\s+\d{4})?"
+_DAU_CUOI = r"(?:đầu|cuối)\s+tháng(?:\s+\d{1,2}(?:(?:\s+năm\s+|/)\d{4})?|\s+này|\s+trước)?"
+_THANG = r"tháng\s+\d{1,2}(?:(?:\s+năm\s+|/)\d{4})?"
+_NAM = r"năm\s+\d{4}"
+_REL = (
+    r"hôm\s+(?:nay|qua|kia)"
+    r"|tuần\s+(?:này|trước|sau)"
+    r"|tháng\s+(?:này|sau|trước(?:\s+trước)*)"
+    r"|quý\s+(?:này|trước)"
+    r"|năm\s+(?:nay|trước|ngoái|sau)"
+)
+_BARE_DAY = r"(?:ngày\s+)?\d{1,2}"
+
+# Thứ tự quan trọng: mẫu dài / cụ thể đứng trước
+_POINT = rf"(?:{_NGAY_THANG}|{_DAU_CUOI}|{_DMY}|{_THANG}|{_NAM}|{_REL})"
+_RANGE_POINT = rf"(?:{_POINT}|{_BARE_DAY})"
+
+# "ngày" trước đầu mút là tuỳ chọn nhưng lazy, để "ngày 30 tháng 9" khớp cả cụm thay vì "30"
+_RANGE_RE = re.compile(
+    rf"(?<!\w)(?:từ\s+)?(?:ngày\s+)??(?P<a>{_RANGE_POINT})\s+(?:đến|tới)\s+(?:ngày\s+)??(?P<b>{_RANGE_POINT})(?!\w)"
+)
+_POINT_RE = re.compile(rf"(?<!\w)(?:{_POINT})(?!\w)")
+
+_DMY_RE = re.compile(r"(\d{1,2})[/-](\d{1,2})(?:[/-](\d{4}))?")
+_NGAY_THANG_RE = re.compile(r"ngày\s+(\d{1,2})\s+tháng\s+(\d{1,2})(?:\s+năm\s+(\d{4}))?")
+_DAU_CUOI_RE = re.compile(r"(đầu|cuối)\s+tháng(?:\s+(\d{1,2})(?:(?:\s+năm\s+|/)(\d{4}))?|\s+(này|trước))?")
+_THANG_RE = re.compile(r"tháng\s+(\d{1,2})(?:(?:\s+năm\s+|/)(\d{4}))?")
+_NAM_RE = re.compile(r"năm\s+(\d{4})")
+_BARE_DAY_RE = re.compile(r"(?:ngày\s+)?(\d{1,2})")
+_WS_RE = re.compile(r"\s+")
+
+# Dấu hiệu câu có thể chứa mốc thời gian (chỉ để quyết định có cần parse hay không,
+# nhận nhầm thì chỉ tốn thêm 1 lần parse). "năm"/"ngày" đứng một mình không tính
+# ("phép năm", "ngày công"), chỉ tính khi theo sau là số hoặc từ chỉ mốc.
+_TIME_HINT_RE = re.compile(
+    r"\d"
+    r"|(?<!\w)(?:hôm|tuần|tháng|quý|thứ|chủ\s+nhật|mai|đến|tới|đầu|cuối|sáng|trưa|chiều|tối|giờ)(?!\w)"
+    r"|(?<!\w)(?:năm|ngày)\s+(?:nay|này|trước|ngoái|sau|kia|mai|qua|\d)"
+)
+
+
+class _Point:
+    """Một mốc thời gian: [start, end] (end inclusive) + grain + năm/tháng có ghi rõ không."""
+
+    __slots__ = ("start", "end", "grain", "explicit_year", "bare")
+
+    def __init__(self, start, end, grain, explicit_year=True, bare=False):
+        self.start = start
+        self.end = end
+        self.grain = grain
+        self.explicit_year = explicit_year
+        self.bare = bare
+
+
+def _day(y, m, d, tz) -> Optional[datetime]:
+    try:
+        return datetime(y, m, d, tzinfo=tz)
+    except ValueError:
+        return None
+
+
+def _day_point(start, explicit_year=True, bare=False):
+    if start is None:
+        return None
+    end = start + timedelta(days=1) - timedelta(seconds=1)
+    return _Point(start, end, "day", explicit_year, bare)
+
+
+def _month_point(start):
+    return _Point(start, _end_of_month(start), "month")
+
+
+def _year_point(year, tz):
+    start = datetime(year, 1, 1, tzinfo=tz)
+    return _Point(start, datetime(year + 1, 1, 1, tzinfo=tz) - timedelta(seconds=1), "year")
+
+
+def _relative_point(expr: str, today: datetime) -> Optional[_Point]:
+    words = expr.split(" ")
+    unit, rest = words[0], words[1:]
+    tz = today.tzinfo
+
+    if unit == "hôm":
+        offset = {"nay": 0, "qua": -1, "kia": -2}[rest[0]]
+        return _day_point(today + timedelta(days=offset))
+
+    if unit == "tuần":
+        offset = {"này": 0, "trước": -1, "sau": 1}[rest[0]]
+        monday = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+        return _Point(monday, monday + timedelta(days=7) - timedelta(seconds=1), "week")
+
+    if unit == "tháng":
+        if rest[0] == "này":
+            offset = 0
+        elif rest[0] == "sau":
+            offset = 1
+        else:
+            offset = -len(rest)  # "tháng trước trước" = lùi 2 tháng
+        return _month_point(_add_months(today, offset))
+
+    if unit == "quý":
+        offset = 0 if rest[0] == "này" else -1
+        q_start = today.replace(month=(today.month - 1) // 3 * 3 + 1, day=1)
+        start = _add_months(q_start, 3 * offset)
+        return _Point(start, _add_months(start, 3) - timedelta(seconds=1), "quarter")
+
+    if unit == "năm":
+        offset = {"nay": 0, "trước": -1, "ngoái": -1, "sau": 1}[rest[0]]
+        return _year_point(today.year + offset, tz)
+
+    return None
+
+
+def _parse_point(expr: str, today: datetime) -> Optional[_Point]:
+    expr = _WS_RE.sub(" ", expr)
+    tz = today.tzinfo
+
+    m = _NGAY_THANG_RE.fullmatch(expr)
+    if m:
+        d, mo, y = m.groups()
+        return _day_point(_day(int(y or today.year), int(mo), int(d), tz), explicit_year=bool(y))
+
+    m = _DAU_CUOI_RE.fullmatch(expr)
+    if m:
+        which, mo, y, rel = m.groups()
+        if mo:
+            if not 1 <= int(mo) <= 12:
+                return None
+            first = datetime(int(y or today.year), int(mo), 1, tzinfo=tz)
+        else:
+            first = _add_months(today, -1 if rel == "trước" else 0)
+        day = first if which == "đầu" else _end_of_month(first).replace(hour=0, minute=0, second=0)
+        return _day_point(day, explicit_year=bool(y) or not mo)
+
+    m = _DMY_RE.fullmatch(expr)
+    if m:
+        d, mo, y = m.groups()
+        return _day_point(_day(int(y or today.year), int(mo), int(d), tz), explicit_year=bool(y))
+
+    m = _THANG_RE.fullmatch(expr)
+    if m:
+        mo, y = m.groups()
+        if not 1 <= int(mo) <= 12:
+            return None
+        return _month_point(datetime(int(y or today.year), int(mo), 1, tzinfo=tz))
+
+    m = _NAM_RE.fullmatch(expr)
+    if m:
+        return _year_point(int(m.group(1)), tz)
+
+    m = _BARE_DAY_RE.fullmatch(expr)
+    if m:
+        return _day_point(_day(today.year, today.month, int(m.group(1)), tz), explicit_year=False, bare=True)
+
+    return _relative_point(expr, today)
+
+
+def _inherit_month(p: _Point, other: _Point, tz) -> Optional[_Point]:
+    """Số ngày trần ("từ 5 đến 10/10") lấy tháng/năm của đầu mút còn lại."""
+    if not p.bare or other.bare or other.grain != "day":
+        return p
+    return _day_point(_day(other.start.year, other.start.month, p.start.day, tz), other.explicit_year)
+
+
+def _point_result(p: _Point) -> dict:
+    if p.grain == "day":
+        return {"type": "single", "date": _to_iso(p.start), "grain": "day"}
+    start, end = _expand_grain_interval(_to_iso(p.start), p.grain, inclusive_end=True, tz=p.start.tzinfo)
+    return {"type": "range", "start": start, "end": end, "grain": p.grain}
+
+
+def _has_leftover(t: str, m) -> bool:
+    """Ngoài đoạn m đã khớp, câu còn số / từ chỉ thời gian (mẫu hiểu thiếu) không."""
+    return _TIME_HINT_RE.search(t[:m.start()] + " " + t[m.end():]) is not None
+
+
+def has_time_hint(text: str) -> bool:
+    """Kiểm tra từ vựng rẻ: câu có số hoặc từ chỉ thời gian không."""
+    return _TIME_HINT_RE.search(canonical_text(text)) is not None
+
+
+def parse_time(text: str, now: Optional[datetime] = None, tz: timezone = TZ) -> Optional[dict]:
+    """
+    Trả về dict cùng dạng normalize_duckling_times, hoặc None nếu không khớp mẫu nào.
+    """
+    if now is None:
+        now = datetime.now(tz)
+    today = now.astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    t = canonical_text(text)
+
+    m = _RANGE_RE.search(t)
+    if m:
+        if _has_leftover(t, m):
+            return None
+        a = _parse_point(m.group("a"), today)
+        b = _parse_point(m.group("b"), today)
+        if a is None or b is None:
+            return None
+        inherited = a.bare or b.bare
+        a = _inherit_month(a, b, tz)
+        b = _inherit_month(b, a, tz)
+        if a is None or b is None:
+            return None
+        end = b.end
+        if end < a.start:
+            # "từ 30/10 đến 5": ngày trần mượn tháng của đầu kia, không đoán thêm năm
+            if b.explicit_year or inherited:
+                return None
+            # "từ 15/12 đến 5/1" → đầu mút sau thuộc năm kế tiếp
+            try:
+                end = end.replace(year=end.year + 1)
+            except ValueError:  # 29/2
+                return None
+        return {"type": "range", "start": _to_iso(a.start), "end": _to_iso(end)}
+
+    m = _POINT_RE.search(t)
+    if m:
+        if _has_leftover(t, m):
+            return None
+        cached = relative_table.get(_WS_RE.sub(" ", m.group(0)), today)
+        if cached is not None:
+            return cached
+        p = _parse_point(m.group(0), today)
+        if p is None:
+            return None
+        return _point_result(p)
+
+    return None